@@ -0,0 +1,167 @@
+"""Filter-and-aggregate engine shared by the figure callbacks.
+
+Every figure reads from one `Aggregates` result per (dataset version, status, customers,
+date range), so a params change filters and groups the charge table once instead of
+once per graph.
+Filters are structured values (a status and a list of customer ids) resolved through
+row-position indexes and rollup index codes, the date range prunes the rollup's monthly
+partitions and the per-date row positions. Daily metrics are answered from the
+dataset's rollup cube. Raw charges are only scanned for the hourly distributions, and
+streamed datasets without a raw frame take those from the rollup's hourly cube too.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import data_store
+from filters import ChargeIndex
+from loader import Charges
+from instrumentation import phase, record_cache
+from rollup import HOURS, Rollup
+
+DEFAULT_STATUS = 'Paid'
+MONEY_COLUMNS = ['fee', 'amount_refunded', 'amount', 'revenue']
+RESULTS_TO_KEEP = 16
+# a result used this recently is kept past RESULTS_TO_KEEP, the figures of a finished job
+# read it after its params are released, however many other jobs finished meanwhile
+PINNED_SECONDS = 60
+HOURLY_COLUMNS = ['reservation_id', 'customer_id', 'date', 'hour']
+# analysts mostly look at the last month, older dates are one date-range change away
+DEFAULT_WINDOW_DAYS = 30
+
+# money frames are named after the slice-selector values, mapped to their rollup column suffix
+SLICES = {'gross': '', 'gross_scooter': '_scooter', 'mean': '_mean', 'mean_scooter': '_mean_scooter'}
+Aggregates = namedtuple('Aggregates', ['counts'] + list(SLICES) + ['hourly_reservations', 'hourly_customers'])
+
+_results = OrderedDict()
+_last_used = {}
+_key_locks = {}
+_lock = threading.Lock()
+
+
+def normalize_status(status: Optional[str]) -> Optional[str]:
+    # an emptied dropdown falls back to paid charges, a cleared one (None) means all statuses
+    return DEFAULT_STATUS if status == '' else status
+
+
+def normalize_date(value) -> Optional[pd.Timestamp]:
+    # the date picker sends ISO strings, possibly with a time part
+    return pd.Timestamp(value).normalize() if value else None
+
+
+def default_range(dates: pd.Index, days: int = DEFAULT_WINDOW_DAYS):
+    """Start and end of the last `days` days of data, (None, None) without data."""
+    if not len(dates):
+        return None, None
+    end = dates.max()
+    return max(end - pd.Timedelta(days=days - 1), dates.min()), end
+
+
+def shares(counts: np.ndarray) -> np.ndarray:
+    return counts / counts.sum() if counts.sum() else counts.astype(float)
+
+
+def hour_shares(hours: np.ndarray) -> np.ndarray:
+    """Share of the values falling into each of the 24 hours."""
+    return shares(np.bincount(hours.astype(np.intp), minlength=HOURS))
+
+
+def aggregate(charges: Optional[Charges], index: Optional[ChargeIndex], rollup: Rollup,
+              status: Optional[str], customer_ids: Sequence[str], start=None, end=None) -> Aggregates:
+    # daily aggregations come from the rollup cells matching the filter
+    with phase('filter'):
+        cells = rollup.cells(status, customer_ids, start, end)
+    with phase('aggregate'):
+        daily = Rollup.by_date(cells)
+    counts = daily[['reservations', 'distinct_reservations', 'customers']]
+    money = {slice: daily[[column + suffix for column in MONEY_COLUMNS]].rename(
+        columns={column + suffix: column for column in MONEY_COLUMNS}) for slice, suffix in SLICES.items()}
+
+    if charges is None:
+        with phase('aggregate'):
+            reservations, customers = rollup.hourly_counts(status, customer_ids, start, end)
+        return Aggregates(counts, **money, hourly_reservations=shares(reservations),
+                          hourly_customers=shares(customers))
+
+    # filtering raw charges for the hourly distributions
+    with phase('filter'):
+        positions = index.positions(status, customer_ids, start, end)
+        cleaned = charges.take(positions, HOURLY_COLUMNS)
+
+    # hourly distributions, de-duplicated by hashing and binned on the server
+    with phase('aggregate'):
+        slice = ['reservation_id', 'date', 'hour']
+        hourly_reservations = hour_shares(cleaned['hour'].values[~cleaned.duplicated(subset=slice).values])
+
+        slice = ['customer_id', 'date', 'hour']
+        hourly_customers = hour_shares(cleaned['hour'].values[~cleaned.duplicated(subset=slice).values])
+
+    return Aggregates(counts, **money, hourly_reservations=hourly_reservations, hourly_customers=hourly_customers)
+
+
+def results_key(dataset: dict, status: Optional[str], customer_ids: Optional[Sequence[str]],
+                start=None, end=None) -> tuple:
+    """Normalized (key, version, status, customers, start, end) the results are cached under."""
+    return (dataset['key'], dataset['version'], normalize_status(status), tuple(sorted(set(customer_ids or ()))),
+            normalize_date(start), normalize_date(end))
+
+
+def compute(key: tuple) -> Aggregates:
+    dataset, version, status, customer_ids, start, end = key
+    # resolved together, an index newer than the charges would point past their last row
+    charges, index, rollup = data_store.snapshot(dataset)
+    return aggregate(charges, index, rollup, status, customer_ids, start, end)
+
+
+def cached(key: tuple) -> Optional[Aggregates]:
+    with _lock:
+        result = _results.get(key)
+        if result is not None:
+            _touch(key)
+        record_cache('aggregates', result is not None)
+        return result
+
+
+def _touch(key: tuple) -> None:
+    _results.move_to_end(key)
+    _last_used[key] = time.monotonic()
+
+
+def store(key: tuple, result: Aggregates) -> None:
+    with _lock:
+        _results[key] = result
+        _touch(key)
+        # least recently used first, so the first pinned result ends the eviction
+        while len(_results) > RESULTS_TO_KEEP:
+            oldest = next(iter(_results))
+            if _last_used[oldest] > _last_used[key] - PINNED_SECONDS:
+                break
+            del _results[oldest], _last_used[oldest]
+
+
+def get_aggregates(dataset: dict, status: Optional[str], customer_ids: Optional[Sequence[str]],
+                   start=None, end=None) -> Aggregates:
+    """Aggregates for a data-store handle, computed once and shared by all figure callbacks."""
+    key = results_key(dataset, status, customer_ids, start, end)
+
+    with _lock:
+        if key in _results:
+            _touch(key)
+            record_cache('aggregates', True)
+            return _results[key]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # callbacks of one params change arrive together, only the first one computes
+    with key_lock:
+        result = cached(key)
+        if result is None:
+            result = compute(key)
+            store(key, result)
+        with _lock:
+            _key_locks.pop(key, None)
+
+    return result
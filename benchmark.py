@@ -0,0 +1,223 @@
+"""Benchmark of the dashboard callbacks on synthetic charge tables.
+
+Charge tables with the schema of `staging_data_cleaned.csv` are generated at the requested
+sizes and customer/status cardinalities, registered in the data store, and `collect_params`
+and every `update_*_graph` of both dashboards are called directly, without a browser or
+a server. Caches are cleared before every call, so the numbers are the cost of a new
+params combination. Per app, size and callback the run reports latency percentiles,
+peak traced memory and the JSON size of the response.
+
+    python benchmark.py --rows 1000 100000 --save bench.json
+    python benchmark.py --rows 1000 100000 --baseline bench.json
+"""
+import argparse
+import importlib
+import inspect
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import aggregations
+import data_store
+from loader import memory_mb, optimize
+
+APPS = ['dash_app', 'dash_app_refactored']
+STATUSES = ['Paid', 'Failed', 'Refunded']
+STATUS_WEIGHTS = [0.56, 0.24, 0.2]
+AMOUNTS = [5.0, 10.0, 15.0, 20.0]
+FEE_SHARE = 0.04
+CHARGES_PER_RESERVATION = 1.2
+PERCENTILES = [50, 90, 99]
+# a p50 this many times the baseline's is reported as a regression
+REGRESSION_RATIO = 1.2
+
+# collect_params arguments of each app, built from one scenario
+PARAMS = {
+    'dash_app': lambda scenario: (scenario['status'], scenario['customer_ids'], scenario['start_date'],
+                                  scenario['end_date'], scenario['graph_width'], scenario['slice']),
+    'dash_app_refactored': lambda scenario: (scenario['status'], scenario['customer_ids'],
+                                             scenario['start_date'], scenario['end_date'], scenario['graph_width']),
+}
+
+
+def synthetic_charges(rows: int, customers: int = 1000, statuses: int = 3, days: int = 365,
+                      seed: int = 0) -> pd.DataFrame:
+    """Typed charge table of `rows` charges over `days` days, sorted by creation time."""
+    rng = np.random.default_rng(seed)
+
+    names = (STATUSES + ['Status_{i}'.format(i=i) for i in range(len(STATUSES), statuses)])[:statuses]
+    weights = np.array((STATUS_WEIGHTS + [STATUS_WEIGHTS[-1]] * statuses)[:statuses])
+    status = rng.choice(statuses, size=rows, p=weights / weights.sum())
+
+    created = pd.Timestamp('2020-01-01') + pd.to_timedelta(np.sort(rng.integers(0, days * 86400, rows)), unit='s')
+    amount = rng.choice(AMOUNTS, size=rows)
+    # refunded charges give everything back, some paid ones a part
+    refunded_code = names.index('Refunded') if 'Refunded' in names else -1
+    refunded = np.where(status == refunded_code, amount,
+                        np.where((status == 0) & (rng.random(rows) < 0.3), amount * 0.75, 0.0))
+    fee = np.where(status == 0, amount * FEE_SHARE, 0.0)
+
+    # charges of one reservation are neighbours in time
+    reservation = (np.arange(rows) / CHARGES_PER_RESERVATION).astype(np.int64)
+    n_reservations = int(reservation[-1]) + 1 if rows else 0
+    reservation_customer = rng.integers(0, customers, n_reservations)
+
+    raw = pd.DataFrame({
+        'id': 'ch_' + pd.Series(np.arange(rows)).astype(str),
+        'created_(utc)': created,
+        'amount': amount,
+        'amount_refunded': refunded,
+        'converted_amount_refunded': refunded,
+        'fee': fee,
+        'status': pd.Categorical.from_codes(status, names),
+        'customer_id': pd.Categorical.from_codes(reservation_customer[reservation],
+                                                 ['cus_{i:010d}'.format(i=i) for i in range(customers)]),
+        'date': created.normalize(),
+        'reservation_id': pd.Categorical.from_codes(reservation,
+                                                    ['res_{i:010d}'.format(i=i) for i in range(n_reservations)]),
+    })
+    return optimize(raw)
+
+
+def scenarios(app: str, dataset: dict, seed: int = 0) -> List[dict]:
+    """Params combinations of the controls: statuses, customer selections, date ranges and slices."""
+    rng = np.random.default_rng(seed)
+    rollup = data_store.get_rollup(dataset)
+    customer_ids = list(rollup.customer_ids())
+    start, end = aggregations.default_range(rollup.dates())
+
+    selections = [[], list(rng.choice(customer_ids, size=min(10, len(customer_ids)), replace=False))]
+    ranges = [(None, None), (str(start.date()), str(end.date()))]
+    slices = list(aggregations.SLICES) if app == 'dash_app' else [None]
+
+    return [{'slice': slice, 'status': status, 'customer_ids': [str(i) for i in selection],
+             'start_date': start_date, 'end_date': end_date, 'graph_width': 700}
+            for slice in slices for status in ['Paid', None] for selection in selections
+            for start_date, end_date in ranges]
+
+
+def clear_caches(app) -> None:
+    app.figure_cache.clear()
+    with aggregations._lock:
+        aggregations._results.clear()
+        aggregations._last_used.clear()
+
+
+def response_bytes(output) -> int:
+    return len(json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+def measure(func: Callable, args: tuple, app):
+    """Latency of one uncached call, then its peak traced memory in a second one."""
+    clear_caches(app)
+    start = time.perf_counter()
+    output = func(*args)
+    seconds = time.perf_counter() - start
+
+    clear_caches(app)
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak, 'response_bytes': response_bytes(output)}, output
+
+
+def summarize(samples: List[dict]) -> dict:
+    milliseconds = 1000 * np.array([sample['seconds'] for sample in samples])
+    summary = {'p{p}_ms'.format(p=p): float(np.percentile(milliseconds, p)) for p in PERCENTILES}
+    summary.update(calls=len(samples),
+                   peak_mb=max(sample['peak_bytes'] for sample in samples) / 2 ** 20,
+                   response_kb=max(sample['response_bytes'] for sample in samples) / 1024)
+    return summary
+
+
+def bench_app(app: str, dataset: dict, repeats: int, seed: int = 0) -> Dict[str, dict]:
+    dash_app = importlib.import_module(app).create_app({'refresh': False, 'preload': True})
+    # the raw callbacks, without Dash's context wrapper, instrumentation and figure cache
+    callbacks = [inspect.unwrap(entry['callback']) for entry in dash_app.callback_map.values() if 'callback' in entry]
+    callbacks = {func.__name__: func for func in callbacks}
+    collect_params = callbacks['collect_params']
+    graphs = {name: func for name, func in callbacks.items() if name.startswith('update_') and name.endswith('_graph')}
+
+    samples = {name: [] for name in ['collect_params'] + sorted(graphs)}
+    combinations = scenarios(app, dataset, seed)
+    for _ in range(repeats):
+        for scenario in combinations:
+            sample, params = measure(collect_params, PARAMS[app](scenario), dash_app)
+            samples['collect_params'].append(sample)
+            # params travel through a dcc.Store, so they arrive JSON decoded
+            selected_params = json.loads(json.dumps(params))
+            for name, update in graphs.items():
+                samples[name].append(measure(update, (selected_params, dataset), dash_app)[0])
+
+    return {name: summarize(items) for name, items in samples.items()}
+
+
+def run(rows: List[int], customers: int, statuses: int, days: int, repeats: int, seed: int = 0) -> List[dict]:
+    results = []
+    for size in rows:
+        start = time.perf_counter()
+        charges = synthetic_charges(size, customers, statuses, days, seed)
+        generated = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dataset = data_store.register('benchmark-{size}'.format(size=size), charges)
+        registered = time.perf_counter() - start
+        print('{size} rows: generated in {generated:.2f} s, {mb:.1f} MB, registered in {registered:.2f} s'.format(
+            size=size, generated=generated, mb=memory_mb(charges), registered=registered))
+
+        for app in APPS:
+            for callback, summary in bench_app(app, dataset, repeats, seed).items():
+                results.append(dict(summary, app=app, rows=size, callback=callback,
+                                    customers=customers, statuses=statuses))
+    return results
+
+
+def _key(result: dict) -> tuple:
+    return result['app'], result['rows'], result['callback']
+
+
+def report(results: List[dict], baseline: Optional[List[dict]] = None) -> str:
+    baseline = {_key(result): result for result in baseline or []}
+    header = '{:<20} {:>9} {:<24} ' + ' '.join(['{:>9}'] * len(PERCENTILES)) + ' {:>8} {:>9} {:>8}'
+    rows = [header.format('app', 'rows', 'callback', *['p{p} ms'.format(p=p) for p in PERCENTILES],
+                          'peak MB', 'resp KB', 'vs base')]
+    for result in results:
+        base = baseline.get(_key(result))
+        ratio = result['p50_ms'] / base['p50_ms'] if base and base['p50_ms'] else None
+        change = '' if ratio is None else '{:.2f}x{}'.format(ratio, ' !' if ratio > REGRESSION_RATIO else '')
+        rows.append(header.format(
+            result['app'], result['rows'], result['callback'],
+            *['{:.2f}'.format(result['p{p}_ms'.format(p=p)]) for p in PERCENTILES],
+            '{:.1f}'.format(result['peak_mb']), '{:.1f}'.format(result['response_kb']), change))
+    return '\n'.join(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='table sizes, up to 10000000')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--statuses', type=int, default=3)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the p50 latencies with a saved JSON file')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.customers, args.statuses, args.days, args.repeats, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as saved:
+            baseline = json.load(saved)['results']
+    print(report(results, baseline))
+
+    if args.save:
+        with open(args.save, 'w') as saved:
+            json.dump({'args': vars(args), 'results': results}, saved, indent=1)
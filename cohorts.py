@@ -0,0 +1,208 @@
+"""First-seen cohorts, day-N retention and repeat rentals of customers.
+
+A customer is active on a date with a paid charge and belongs to the cohort of the
+first such date. `Cohorts` keeps the sorted unique (customer, date) activity keys and
+a matrix of active customers per (cohort date, days since first seen). `update` only
+looks at the new rows: keys already known are skipped, new ones are added to the
+matrix, and the rare customer whose first date moves earlier (late rows) has their
+keys moved to the new cohort. Distinct paid reservations per customer give the repeat
+rental numbers. Everything is done on NumPy arrays, there is no per-customer loop.
+
+Daily cohorts are summed into weekly or monthly ones at query time. Retention of a
+(cohort, day N) cell only counts the customers whose day N is already in the data.
+"""
+import threading
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+ACTIVE_STATUS = 'Paid'
+MAX_DAYS = 90
+COHORT_FREQ = 'W'
+# keys are customer code << 32 | days since epoch
+_DAY_BITS = 32
+_DAY_MASK = (1 << _DAY_BITS) - 1
+# first-seen day of a customer without activity
+_NEVER = np.iinfo(np.int64).max
+
+
+def _contains(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    positions = np.searchsorted(sorted_values, values)
+    found = np.zeros(len(values), dtype=bool)
+    inside = positions < len(sorted_values)
+    found[inside] = sorted_values[positions[inside]] == values[inside]
+    return found
+
+
+def _insert(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    return np.insert(sorted_values, np.searchsorted(sorted_values, values), values)
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """Concatenated np.arange(start, stop) of every pair."""
+    lengths = stops - starts
+    return np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+
+
+class Cohorts:
+
+    def __init__(self, max_days: int = MAX_DAYS):
+        self.max_days = max_days
+        # customer ids by code, only ever extended: readers take the codes of the arrays they hold
+        self._customers: List[str] = []
+        self._codes_of: Dict[str, int] = {}
+        self._first = np.zeros(0, dtype=np.int64)
+        self._rentals = np.zeros(0, dtype=np.int64)
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._reservations = np.zeros(0, dtype=np.uint64)
+        # active customers per (first-seen day - origin, days since first seen)
+        self._matrix = np.zeros((0, max_days + 1), dtype=np.int64)
+        self._origin = 0
+        self._last = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, max_days: int = MAX_DAYS) -> 'Cohorts':
+        cohorts = cls(max_days)
+        cohorts.update(df)
+        return cohorts
+
+    def _codes(self, customer_ids: np.ndarray) -> np.ndarray:
+        # only the ids of the batch are looked up, the known ones are not rehashed on each update
+        inverse, unique = pd.factorize(customer_ids)
+        new = [customer_id for customer_id in unique if customer_id not in self._codes_of]
+        if new:
+            self._codes_of.update(zip(new, range(len(self._customers), len(self._customers) + len(new))))
+            self._customers.extend(new)
+            self._first = np.concatenate([self._first, np.full(len(new), _NEVER, dtype=np.int64)])
+            self._rentals = np.concatenate([self._rentals, np.zeros(len(new), dtype=np.int64)])
+        return np.array([self._codes_of[customer_id] for customer_id in unique], dtype=np.int64)[inverse]
+
+    def _add(self, keys: np.ndarray, sign: int) -> None:
+        days = keys & _DAY_MASK
+        first = self._first[keys >> _DAY_BITS]
+        offsets = days - first
+        kept = offsets <= self.max_days
+        first, offsets = first[kept], offsets[kept]
+        if not len(first):
+            return
+
+        # the matrix grows to the cohorts it has not seen yet, on either side
+        origin = min(self._origin, int(first.min())) if len(self._matrix) else int(first.min())
+        rows = max(self._origin + len(self._matrix), int(first.max()) + 1) - origin
+        matrix = np.zeros((rows, self.max_days + 1), dtype=np.int64)
+        matrix[self._origin - origin:self._origin - origin + len(self._matrix)] = self._matrix
+
+        cells = (first - origin) * (self.max_days + 1) + offsets
+        matrix += sign * np.bincount(cells, minlength=matrix.size).reshape(matrix.shape)
+        self._matrix, self._origin = matrix, origin
+
+    def update(self, rows: pd.DataFrame) -> None:
+        """Fold new charge rows in, only keys not seen before touch the matrix."""
+        active = (np.asarray(rows['status'], dtype=object) == ACTIVE_STATUS) & rows['customer_id'].notna().values
+        if not active.any():
+            return
+
+        with self._lock:
+            customer_ids = np.asarray(rows['customer_id'], dtype=object)[active]
+            days = np.asarray(rows['date'], dtype='datetime64[D]')[active].astype(np.int64)
+            codes = self._codes(customer_ids)
+            self._rentals = self._rentals + self._new_rentals(rows, active, codes)
+            last = pd.Timestamp(days.max(), unit='D')
+            self._last = last if self._last is None else max(self._last, last)
+
+            keys = np.unique((codes.astype(np.int64) << _DAY_BITS) | days)
+            keys = keys[~_contains(self._keys, keys)]
+            if not len(keys):
+                return
+
+            # keys are sorted by customer then day, the first key of a customer is their earliest new day
+            touched, first_keys = np.unique(keys >> _DAY_BITS, return_index=True)
+            earliest = keys[first_keys] & _DAY_MASK
+            moved = touched[(earliest < self._first[touched]) & (self._first[touched] != _NEVER)]
+
+            # customers seen before their known first date leave their old cohort with all their keys
+            old = self._keys[np.isin(self._keys >> _DAY_BITS, moved)]
+            self._add(old, -1)
+
+            first = self._first.copy()
+            first[touched] = np.minimum(first[touched], earliest)
+            self._first = first
+            self._keys = _insert(self._keys, keys)
+            self._add(np.concatenate([keys[~np.isin(keys >> _DAY_BITS, moved)],
+                                      self._keys[np.isin(self._keys >> _DAY_BITS, moved)]]), 1)
+
+    def _new_rentals(self, rows: pd.DataFrame, active: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        reservations = np.asarray(rows['reservation_id'], dtype=object)[active]
+        known = pd.notna(reservations)
+        hashes, first = np.unique(pd.util.hash_array(reservations[known]), return_index=True)
+        new = ~_contains(self._reservations, hashes)
+        self._reservations = _insert(self._reservations, hashes[new])
+        return np.bincount(codes[known][first[new]], minlength=len(self._customers))
+
+    def _selection(self, customer_ids: Iterable[str]):
+        """Matrix rows, first days and rentals of the selected customers (all of them without a selection)."""
+        customer_ids = list(customer_ids)
+        with self._lock:
+            matrix, origin, keys = self._matrix, self._origin, self._keys
+            first, rentals, codes_of = self._first, self._rentals, self._codes_of
+        if not customer_ids:
+            return matrix, origin, first[first != _NEVER], rentals[first != _NEVER]
+
+        # customers added after the arrays were taken have codes past them
+        codes = np.array([codes_of.get(customer_id, len(first)) for customer_id in customer_ids], dtype=np.int64)
+        codes = np.unique(codes[codes < len(first)])
+        codes = codes[first[codes] != _NEVER]
+        # the keys of a customer are contiguous, so the selection is a few binary searches
+        selected = keys[_ranges(np.searchsorted(keys, codes << _DAY_BITS),
+                                np.searchsorted(keys, (codes + 1) << _DAY_BITS))]
+        cohorts = Cohorts(self.max_days)
+        cohorts._first = first
+        cohorts._add(selected, 1)
+        return cohorts._matrix, cohorts._origin, first[codes], rentals[codes]
+
+    def retention(self, customer_ids: Iterable[str] = (), start=None, end=None,
+                  freq: str = COHORT_FREQ) -> pd.DataFrame:
+        """Share of each cohort active N days after its first date, cohorts first seen in [start, end].
+
+        Cells whose day N is past the last date of the data are NaN.
+        """
+        matrix, origin, first, rentals = self._selection(customer_ids)
+        if self._last is None or not len(matrix):
+            return pd.DataFrame(columns=range(self.max_days + 1), dtype=float)
+
+        dates = pd.to_datetime(origin + np.arange(len(matrix)), unit='D')
+        last = (self._last - dates).days.values
+        # customers of a daily cohort are all active on day 0
+        observed = matrix[:, :1] * (np.arange(self.max_days + 1) <= last[:, None])
+        periods = dates.to_period(freq).start_time
+
+        selected = np.ones(len(dates), dtype=bool)
+        if start is not None:
+            selected &= dates >= pd.Timestamp(start)
+        if end is not None:
+            selected &= dates <= pd.Timestamp(end)
+
+        active = pd.DataFrame(matrix[selected], index=periods[selected]).groupby(level=0).sum()
+        sizes = pd.DataFrame(observed[selected], index=periods[selected]).groupby(level=0).sum()
+        retention = active.where(sizes > 0) / sizes.where(sizes > 0)
+        return retention[active[0] > 0].rename_axis('cohort')
+
+    def repeat_rentals(self, customer_ids: Iterable[str] = (), start=None, end=None,
+                       freq: str = COHORT_FREQ) -> pd.DataFrame:
+        """Customers, repeat renters (more than one paid reservation) and rentals per customer by cohort."""
+        matrix, origin, first, rentals = self._selection(customer_ids)
+        dates = pd.to_datetime(first, unit='D')
+        selected = np.ones(len(dates), dtype=bool)
+        if start is not None:
+            selected &= dates >= pd.Timestamp(start)
+        if end is not None:
+            selected &= dates <= pd.Timestamp(end)
+
+        per_customer = pd.DataFrame({'customers': 1, 'repeat_customers': (rentals > 1).astype(np.int64),
+                                     'rentals': rentals}, index=dates.to_period(freq).start_time)[selected]
+        cohorts = per_customer.groupby(level=0).sum().rename_axis('cohort')
+        cohorts['repeat_rate'] = cohorts['repeat_customers'] / cohorts['customers']
+        cohorts['rentals_per_customer'] = cohorts['rentals'] / cohorts['customers']
+        return cohorts
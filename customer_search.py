@@ -0,0 +1,109 @@
+"""Server-side typeahead over customer ids.
+
+The customer dropdown no longer ships every id in the layout, it asks the server for
+the ids matching what the user typed. Prefix matches come from a sorted array (binary
+search), substring matches from a trigram index, and at most `limit` ids are returned.
+
+Customers seen after the index was built are added as a new part, merged with the
+previous parts like `Charges` segments, so an append indexes its new customers only.
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import data_store
+from rollup import Rollup
+
+SEARCH_LIMIT = 20
+
+_indexes: Dict[str, Tuple[Rollup, int, 'CustomerIndex']] = {}
+_lock = threading.Lock()
+
+
+def trigrams(value: str) -> Iterable[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class _Part:
+
+    def __init__(self, customer_ids: Iterable[str]):
+        ids = sorted({str(customer_id) for customer_id in customer_ids})
+        self._ids = np.array(ids, dtype=object)
+        self._folded = np.array([customer_id.lower() for customer_id in ids], dtype=object)
+        self._order = np.argsort(self._folded, kind='stable')
+        self._sorted_folded = self._folded[self._order]
+
+        self._trigrams = defaultdict(list)
+        for position, customer_id in enumerate(self._folded):
+            for trigram in trigrams(customer_id):
+                self._trigrams[trigram].append(position)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def prefix(self, query: str, limit: int) -> List[str]:
+        start = np.searchsorted(self._sorted_folded, query, side='left')
+        stop = np.searchsorted(self._sorted_folded, query + '\uffff', side='left')
+        return list(self._ids[self._order[start:min(stop, start + limit)]])
+
+    def substring(self, query: str, grams: Iterable[str], limit: int) -> List[str]:
+        # the rarest trigram bounds the candidates, the others and the full query narrow them down
+        candidates = min((self._trigrams.get(gram, []) for gram in grams), key=len)
+        matches = [position for position in candidates if query in self._folded[position]]
+        return list(self._ids[matches[:limit]])
+
+
+class CustomerIndex:
+
+    def __init__(self, customer_ids: Iterable[str] = (), parts: Optional[List[_Part]] = None):
+        self._parts = parts if parts is not None else [_Part(customer_ids)]
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self._parts)
+
+    def extended(self, customer_ids: Iterable[str]) -> 'CustomerIndex':
+        """A new index with `customer_ids` added, the parts of this one are shared."""
+        parts = self._parts + [_Part(customer_ids)]
+        while len(parts) > 2 and len(parts[-2]) <= len(parts[-1]):
+            parts[-2:] = [_Part(list(parts[-2]._ids) + list(parts[-1]._ids))]
+        return CustomerIndex(parts=parts)
+
+    def prefix(self, query: str, limit: int) -> List[str]:
+        query = query.lower()
+        found = [customer_id for part in self._parts for customer_id in part.prefix(query, limit)]
+        return sorted(found, key=lambda customer_id: (customer_id.lower(), customer_id))[:limit]
+
+    def substring(self, query: str, limit: int) -> List[str]:
+        query = query.lower()
+        grams = trigrams(query)
+        if not grams:
+            return []
+        found = [customer_id for part in self._parts for customer_id in part.substring(query, grams, limit)]
+        return sorted(found)[:limit]
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[str]:
+        query = query.strip()
+        if not query:
+            return []
+
+        found = self.prefix(query, limit)
+        if len(found) < limit:
+            found += [customer_id for customer_id in self.substring(query, limit) if customer_id not in found]
+        return found[:limit]
+
+
+def index_for(dataset: dict) -> CustomerIndex:
+    """Index over the customers of a data-store handle, extended with the customers appended since."""
+    rollup = data_store.get_rollup(dataset)
+    # one build at a time, concurrent keystrokes wait for it instead of repeating it
+    with _lock:
+        indexed, count, index = _indexes.get(dataset['key'], (None, 0, None))
+        if indexed is not rollup:
+            count, index = 0, None
+        customer_ids = rollup.customers_since(count)
+        if index is None or customer_ids:
+            index = CustomerIndex(customer_ids) if index is None else index.extended(customer_ids)
+            _indexes[dataset['key']] = (rollup, count + len(customer_ids), index)
+        return index
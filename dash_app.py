@@ -1,380 +1,240 @@
-import pandas as pd
-from typing import List, Union
-import random
-import plotly.express as px
-import plotly.graph_objects as go
+import time
+from typing import List, Optional
+
+IMPORT_STARTED = time.perf_counter()
 
 # dash specific imports
+import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import dash.dependencies
-from dash.dependencies import Input, Output
+from dash.dependencies import Input
 import dash_bootstrap_components as dbc
 
-# constants and needed options
-data = pd.read_csv('data/staging_data_cleaned.csv')
-statuses = data['status'].unique()
-dates = data['date'].unique()
-customer_ids = data['customer_id'].unique()
-
-PLOTLY_THEME = 'simple_white'
-N_SCOOTERS = pd.DataFrame(data=[random.randint(5, 10) for i in range(0, len(dates))], columns=['n_scooters'])
-
-
-def stringify(x: Union[str, int]) -> str:
-    return "'"+str(x)+"'"
-
-
-# components
-controls = dbc.Card(
-    [
-        dbc.FormGroup(
-            [
-                dbc.Label("Metric aggregation slice", id='slice-selector-header'),
-                dcc.Dropdown(
-                    id="slice-selector",
-                    options=[{"label": 'Gross per day', "value": 'gross'},
-                             {"label": 'Gross per scooter', "value": 'gross_scooter'},
-                             {"label": 'Mean per day', "value": 'mean'},
-                             {"label": 'Mean per scooter', "value": 'mean_scooter'}],
-                    value="gross",
-                ),
-                dbc.Tooltip('Per scooter metrics are calculated with a help '
-                            'of randomly generated vector of scooter quantity for each date point. '
-                            'In real life count of scooter ids shall be used.',
-                            target="slice-selector-header"),
-            ]
-        ),
-        dbc.FormGroup(
-            [
-                dbc.Label("Transaction status", id='status-selector-header'),
-                dcc.Dropdown(
-                    id="status-selector",
-                    options=[{"label": col, "value": col} for col in statuses],
-                    value="Paid",
-                ),
-                dbc.Tooltip('Select status to drill into statistics.', target="status-selector-header"),
-
-            ]
-        ),
-        dbc.FormGroup(
-            [
-                dbc.Label("Customer ID", id='customer-id-selector-header'),
-                dcc.Dropdown(
-                    id="customer-id-selector",
-                    options=[{"label": col, "value": col} for col in customer_ids],
-                    value="", multi=True,
-                ),
-                dbc.Tooltip('Multiple selection of customers makes it possible to track a set of customers over time.'
-                            , target="customer-id-selector-header"),
-            ]
-        ),
-        # dbc.FormGroup(
-        #     [
-        #         dbc.Label("Disputed or not "),
-        #         dcc.Dropdown(
-        #             id="disputes-selector",
-        #             options=[{"label": col, "value": col} for col in data['customer_id'].unique()],
-        #             value="Not disputed",
-        #         ),
-        #     ]
-        # ),
-        html.Div(id='params-store', style={'display': 'none'}),
-        dcc.Store(id='data-store', data=data.to_dict('records')),
-    ],
-    body=True,
-)
-
-qty_graph = dcc.Graph(id='qty-graph')
-time_graph = dcc.Graph(id='time-graph')
-money_graph = dcc.Graph(id='raw-money-graph')
-margin_graph = dcc.Graph(id='margin-graph')
-
-# dash app run
-app = dash.Dash(name='staging_dashboard', external_stylesheets=[dbc.themes.FLATLY])
-server = app.server
-
+import dashboard
+from dashboard import aggregations, data_store, downsampling, go
+from figure_style import unstyled_figure
+from instrumentation import metrics, phase
 
-# general layout
-app.layout = dbc.Container(
-    [
-     html.H1("Staging data dashboard"),
-     html.Hr(),
-     dbc.Row([dbc.Col(controls, width=2),
-              dbc.Col(qty_graph, width=5),
-              dbc.Tooltip('A basic count plot for unique registrations and customers by day.', target="qty-graph"),
-              dbc.Col(time_graph, width=5),
-              dbc.Tooltip('A basic distribution plot for unique registrations and customers.', target="time-graph"),
-              ], align="center"),
-     dbc.Row([
-              dbc.Col(money_graph, width=5),
-              dbc.Tooltip('Green filled area is difference between holded funds, or in other words - revenue.'
-                          'In cases when status is "Refunded" or "Failed" there is no revenue.',
-                          target="raw-money-graph"),
-              dbc.Col(margin_graph, width=5),
-              dbc.Tooltip('Green filled area in this case is difference between revenue and fees,  '
-                          'which results in margin. '
-                          'In cases when status is "Refunded" or "Failed" mo margin is calculated.',
-                          target="margin-graph"),
-              ], align="right", justify="end")
-    ], fluid=True
+# the shared options, a config passed to create_app overrides them
+DEFAULT_CONFIG = dict(
+    dashboard.DEFAULT_CONFIG,
+    # cohorts of the retention heatmap: first-seen week 'W' or month 'M'
+    cohort_freq='W',
 )
+MONEY_YAXIS_TITLES = {'gross': "$, gross", 'gross_scooter': "$ per scooter, gross",
+                      'mean': "$, mean", 'mean_scooter': "$ per scooter, mean"}
+
+# graphs rendered in the browser from their figure store, with whether the y axis scale option applies
+GRAPHS = {'qty-graph': True, 'time-graph': False, 'raw-money-graph': True, 'margin-graph': True,
+          'retention-graph': False}
+
+metrics.record_startup('import', time.perf_counter() - IMPORT_STARTED)
+
+
+def page(filter_controls: List) -> List:
+    # components
+    controls = dbc.Card(
+        [
+            dbc.FormGroup(
+                [
+                    dbc.Label("Metric aggregation slice", id='slice-selector-header'),
+                    dcc.Dropdown(
+                        id="slice-selector",
+                        options=[{"label": 'Gross per day', "value": 'gross'},
+                                 {"label": 'Gross per scooter', "value": 'gross_scooter'},
+                                 {"label": 'Mean per day', "value": 'mean'},
+                                 {"label": 'Mean per scooter', "value": 'mean_scooter'}],
+                        value="gross",
+                    ),
+                    dbc.Tooltip('Per scooter metrics divide each date by its fleet size from '
+                                'data/fleet_size.csv. Until that file exists a placeholder of 5 to 10 '
+                                'scooters per date is used.',
+                                target="slice-selector-header"),
+                ]
+            ),
+        ] + filter_controls,
+        body=True,
+    )
+
+    qty_graph = dcc.Graph(id='qty-graph')
+    time_graph = dcc.Graph(id='time-graph')
+    money_graph = dcc.Graph(id='raw-money-graph')
+    margin_graph = dcc.Graph(id='margin-graph')
+    retention_graph = dcc.Graph(id='retention-graph')
+
+    # general layout
+    return [
+        html.H1("Staging data dashboard"),
+        html.Hr(),
+        dbc.Row([dbc.Col(controls, width=2),
+                 dbc.Col(qty_graph, width=5),
+                 dbc.Tooltip('A basic count plot for unique registrations and customers by day.',
+                             target="qty-graph"),
+                 dbc.Col(time_graph, width=5),
+                 dbc.Tooltip('A basic distribution plot for unique registrations and customers.',
+                             target="time-graph"),
+                 ], align="center"),
+        dbc.Row([
+                 dbc.Col(money_graph, width=5),
+                 dbc.Tooltip('Green filled area is difference between holded funds, or in other words - '
+                             'revenue.In cases when status is "Refunded" or "Failed" there is no revenue.',
+                             target="raw-money-graph"),
+                 dbc.Col(margin_graph, width=5),
+                 dbc.Tooltip('Green filled area in this case is difference between revenue and fees,  '
+                             'which results in margin. '
+                             'In cases when status is "Refunded" or "Failed" mo margin is calculated.',
+                             target="margin-graph"),
+                 ], align="right", justify="end"),
+        dbc.Row([
+                 dbc.Col(retention_graph, width=10),
+                 dbc.Tooltip('Share of the customers first paying in a week of the selected dates who paid '
+                             'again N days later. Days not in the data yet are left blank.',
+                             target="retention-graph"),
+                 ], align="right", justify="end")
+    ]
+
+
+def create_app(config: Optional[dict] = None) -> dash.Dash:
+    """The dashboard, its data is loaded by the first request or by `app.load_data()`.
+
+    The figure cache, job queue and refresher are attributes of the returned app.
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    # the slice selector is the last value of the params
+    app = dashboard.create_dashboard('staging_dashboard', config, GRAPHS, page,
+                                     [Input(component_id='slice-selector', component_property='value')])
+
+    @app.figure_callback('time-graph')
+    def update_time_graph(selected_params: List, dataset: dict):
+
+        status, customer_ids, start_date, end_date, points, slice = selected_params
+        aggregates = aggregations.get_aggregates(dataset, status, customer_ids, start_date, end_date)
+
+        fig = unstyled_figure()
+        fig.add_trace(go.Bar(x=list(range(aggregations.HOURS)), y=aggregates.hourly_reservations,
+                             name='reservations per hour'))
+        fig.add_trace(go.Bar(x=list(range(aggregations.HOURS)), y=aggregates.hourly_customers,
+                             name='unique customers per hour'))
+
+        fig.update_traces(opacity=0.75)
+
+        fig.update_layout(title_text="Hourly distributions", xaxis_title=u"date",
+                          yaxis_title="perc.", barmode='overlay', legend=dict(x=.02, y=.99),
+                          xaxis=dict(tickmode='linear', tick0=0, dtick=1)
+                          )
+        return fig
+
+    @app.figure_callback('qty-graph')
+    def update_qty_graph(selected_params: List, dataset: dict):
+
+        status, customer_ids, start_date, end_date, points, slice = selected_params
+        counts = aggregations.get_aggregates(dataset, status, customer_ids, start_date, end_date).counts
+        method = config['downsampling']
+
+        fig = unstyled_figure()
+        fig.add_trace(downsampling.scatter(counts.index, counts['reservations'].values, points, method, fill=None,
+                                           mode='lines+markers', name='reservations', line={'color': 'indigo'}))
+        fig.add_trace(
+            downsampling.scatter(counts.index, counts['customers'].values, points, method, fill=None,
+                                 mode='lines+markers', name='customers', line={'color': 'orange'}))
+
+        fig.update_layout(title_text="Count metrics by day", xaxis_title=u"date",
+                          yaxis_title="qty", legend=dict(x=.8, y=.99))
+        return fig
+
+    @app.figure_callback('raw-money-graph')
+    def update_raw_money_graph(selected_params: List, dataset: dict):
+
+        status, customer_ids, start_date, end_date, points, slice = selected_params
+        aggregates = aggregations.get_aggregates(dataset, status, customer_ids, start_date, end_date)
+        method = config['downsampling']
+
+        status = aggregations.normalize_status(status)
+        revenue_filler = 'tonexty' if status == 'Paid' else None
+
+        # every slice, per scooter ones included, is a ready frame of the shared aggregation pass
+        money = getattr(aggregates, slice if slice in MONEY_YAXIS_TITLES else 'gross')
+
+        fig = unstyled_figure()
+        fig.update_layout(yaxis_title=MONEY_YAXIS_TITLES.get(slice))
+
+        # adding lines on figure
+
+        fig.add_trace(downsampling.scatter(money.index, money['fee'].values, points, method, fill=None,
+                                           mode='lines+markers', name='fees', line={'color': 'orange'}))
+
+        fig.add_trace(downsampling.scatter(money.index, money['amount_refunded'].values, points, method, fill=None,
+                                           mode='lines+markers', name='amount_refunded', line={'color': 'tomato'}))
+
+        fig.add_trace(downsampling.scatter(money.index, money['amount'].values, points, method,
+                                           fill=revenue_filler, mode='lines+markers', name='on hold',
+                                           line={'color': 'green'}))
+
+        fig.update_yaxes(tick0=-0.5)
+
+        fig.update_layout(title_text="Raw money streams by day",
+                          xaxis_title=u"date")
+
+        return fig
+
+    @app.figure_callback('margin-graph')
+    def update_margin_graph(selected_params: List, dataset: dict):
 
+        status, customer_ids, start_date, end_date, points, slice = selected_params
+        method = config['downsampling']
+        fig = unstyled_figure()
 
-@app.callback(Output(component_id='params-store', component_property='children'),
-              [Input(component_id='slice-selector', component_property='value'),
-               Input(component_id='status-selector', component_property='value'),
-               Input(component_id='customer-id-selector', component_property='value')])
-def collect_params(slice: str, status: str, customer_ids: str):
-
-    customer_ids = ', '.join([stringify(i)for i in customer_ids])
-    params = slice, status, customer_ids
-    return params
-
-
-@app.callback(Output(component_id='time-graph', component_property='figure'),
-              [Input(component_id='params-store', component_property='children'),
-               Input(component_id='data-store', component_property='data')])
-def update_time_graph(selected_params: List, df: pd.DataFrame):
-
-    df = pd.DataFrame(df)
-    global statuses
-    slice, status, customer_ids = selected_params
-    status = 'Paid' if status == '' else status
-    cleaned_df = df[df['status'] == status]
-
-    cleaned_df['hour'] = pd.to_datetime(cleaned_df['created_(utc)']).apply(lambda x: x.hour)
-
-    hourly_reservations = cleaned_df[['reservation_id', 'date', 'hour']].sort_values(
-        ['reservation_id', 'date', 'hour']).drop_duplicates()['hour']
-
-    hourly_customers = cleaned_df[['customer_id', 'date', 'hour']].sort_values(
-        ['customer_id', 'date', 'hour']).drop_duplicates()['hour']
-
-    fig = go.Figure()
-    fig.add_trace(go.Histogram(x=hourly_reservations.values, histnorm='probability', nbinsx=24,
-                               name='reservations per hour'))
-    fig.add_trace(go.Histogram(x=hourly_customers.values, histnorm='probability', nbinsx=24,
-                               name='unique customers per hour'))
-
-    fig.update_traces(opacity=0.75)
-
-    fig.update_layout(template=PLOTLY_THEME, title_text="Hourly distributions", xaxis_title=u"date",
-                      yaxis_title="perc.", barmode='overlay', legend=dict(x=.02, y=.99),
-                      xaxis=dict(tickmode='linear', tick0=0, dtick=1)
-                      )
-    return fig
-
-
-@app.callback(Output(component_id='qty-graph', component_property='figure'),
-              [Input(component_id='params-store', component_property='children'),
-               Input(component_id='data-store', component_property='data')])
-def update_qty_graph(selected_params: List, df: pd.DataFrame):
-
-    df = pd.DataFrame(df)
-    global statuses
-    slice, status, customer_ids = selected_params
-
-    status = 'Paid' if status == '' else status
-    status_query = 'status in {status} '.format(status=stringify(status)) if status else ''
-    customer_query = ' customer_id in ({customer_id})'.format(customer_id=customer_ids) if customer_ids != '' else ''
-
-    if 0 not in (len(status_query), len(customer_query)):
-        total_query = status_query + 'and' + customer_query
-    else:
-        total_query = status_query + customer_query
-
-    cleaned = df.query(total_query) if total_query != '' else df
-    reservations = (cleaned.groupby('date')['reservation_id'].count()).reset_index()
-    customer_cnt = (cleaned.groupby('date')['customer_id'].nunique()).reset_index()
-
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=reservations['date'].values, y=reservations['reservation_id'].values, fill=None, mode='lines+markers',
-                             name='reservations', line={'color': 'indigo'}))
-    fig.add_trace(
-        go.Scatter(x=customer_cnt['date'].values, y=customer_cnt['customer_id'].values, fill=None, mode='lines+markers',
-                   name='customers', line={'color': 'orange'}))
-
-    fig.update_layout(template=PLOTLY_THEME, title_text="Count metrics by day", xaxis_title=u"date",
-                      yaxis_title="qty", legend=dict(x=.8, y=.99))
-    return fig
-
-
-@app.callback(Output(component_id='raw-money-graph', component_property='figure'),
-              [Input(component_id='params-store', component_property='children'),
-               Input(component_id='data-store', component_property='data')])
-def update_raw_money_graph(selected_params: List, df: pd.DataFrame):
-
-    df = pd.DataFrame(df)
-    slice, status, customer_ids = selected_params
-
-    global statuses
-
-    status = 'Paid' if status == '' else status
-    revenue_filler = 'tonexty' if status == 'Paid' else None
-    status_query = 'status in {status} '.format(status=stringify(status)) if status else ''
-    customer_query = ' customer_id in ({customer_id})'.format(customer_id=customer_ids) if customer_ids != '' else ''
-
-    if 0 not in (len(status_query), len(customer_query)):
-        total_query = status_query + 'and' + customer_query
-    else:
-        total_query = status_query + customer_query
-
-    cleaned_df = df.query(total_query) if total_query != '' else df
-
-    if 'mean' in slice:
-        fees = cleaned_df.groupby('date')['fee'].mean().reset_index()
-        refunds = cleaned_df.groupby('date')['amount_refunded'].mean().reset_index()
-        hold = cleaned_df.groupby('date')['amount'].mean().reset_index()
-
-        df = fees.merge(refunds, on='date', how='inner').merge(hold, on='date', how='inner')
-
-        if slice == 'mean':
-            fig = go.Figure()
-            fig.update_layout(yaxis_title="$, mean")
-
-        elif slice == 'mean_scooter':
-            df = (pd.concat([df, N_SCOOTERS], axis=1)).set_index('date')
-            df = (df[['fee', 'amount_refunded', 'amount']].div(df['n_scooters'], axis=0)).reset_index()
-
-            fig = go.Figure()
-            fig.update_layout(yaxis_title="$ per scooter, mean")
-
-    elif 'gross' in slice:
-        fees = cleaned_df.groupby('date')['fee'].sum().reset_index()
-        refunds = cleaned_df.groupby('date')['amount_refunded'].sum().reset_index()
-        hold = cleaned_df.groupby('date')['amount'].sum().reset_index()
-
-        df = fees.merge(refunds, on='date', how='inner').merge(hold, on='date', how='inner')
+        if status == 'Paid' and slice in MONEY_YAXIS_TITLES:
+            money = getattr(aggregations.get_aggregates(dataset, status, customer_ids, start_date, end_date), slice)
+            fig.update_layout(yaxis_title=MONEY_YAXIS_TITLES[slice])
 
-        if slice == 'gross':
-            fig = go.Figure()
-            fig.update_layout(yaxis_title="$, gross")
+            fig.add_trace(downsampling.scatter(money.index, money['fee'].values, points, method, fill=None,
+                                               mode='lines+markers', name='fees', line={'color': 'yellow'}))
+            fig.add_trace(downsampling.scatter(money.index, money['revenue'].values, points, method,
+                                               fill='tonexty', mode='lines+markers', name='revenue',
+                                               line={'color': 'green'}))
 
-        elif slice == 'gross_scooter':
-            df = (pd.concat([df, N_SCOOTERS], axis=1)).set_index('date')
-            df = (df[['fee', 'amount_refunded', 'amount']].div(df['n_scooters'], axis=0)).reset_index()
+        fig.update_yaxes(tick0=-0.5)
+        fig.update_layout(title_text="Margin by day", xaxis_title=u"date")
 
-            fig = go.Figure()
-            fig.update_layout(yaxis_title="$ per scooter, gross")
-    else:
-        fig = go.Figure()
+        return fig
 
-    # if 'gross' in slice:
-    #     fees = cleaned_df.groupby('date')['fee'].sum().reset_index()
-    #     refunds = cleaned_df.groupby('date')['amount_refunded'].sum().reset_index()
-    #     revenue = cleaned_df.groupby('date')['revenue'].sum().reset_index()
-    #
-    # if slice == 'gross':
-    #
-    #     fees = cleaned_df.groupby('date')['fee'].sum().reset_index()
-    #     refunds = cleaned_df.groupby('date')['amount_refunded'].sum().reset_index()
-    #     revenue = cleaned_df.groupby('date')['revenue'].sum().reset_index()
-    #
-    #     df = fees.merge(refunds, on='date', how='inner').merge(revenue, on='date', how='inner')
-    #     fig = go.Figure()
-    #     fig.update_layout(yaxis_title="$, gross")
-    #
-    # elif slice == 'mean':
-    #
-    #     fees = cleaned_df.groupby('date')['fee'].mean().reset_index()
-    #     refunds = cleaned_df.groupby('date')['amount_refunded'].mean().reset_index()
-    #     revenue = cleaned_df.groupby('date')['revenue'].mean().reset_index()
-    #
-    #     df = fees.merge(refunds, on='date', how='inner').merge(revenue, on='date', how='inner')
-    #     fig = go.Figure()
-    #     fig.update_layout(yaxis_title="$, gross")
-    #
-    # elif slice == 'scooter_mean':
-    #     df = fees.merge(refunds, on='date', how='inner').merge(revenue, on='date', how='inner')
-    #     df = (pd.concat([df, N_SCOOTERS], axis=1)).set_index('date')
-    #     df = (df[['fee', 'amount_refunded', 'revenue']].div(df['n_scooters'], axis=0)).reset_index()
-    #
-    #     fig = go.Figure()
-    #     fig.update_layout(yaxis_title="$, per scooter")
+    @app.figure_callback('retention-graph')
+    def update_retention_graph(selected_params: List, dataset: dict):
 
-    # adding lines on figure
+        # cohorts are made of paid charges, the status selector does not apply
+        status, customer_ids, start_date, end_date, points, slice = selected_params
+        cohorts = data_store.get_cohorts(dataset)
+        if cohorts is None:
+            fig = unstyled_figure()
+            fig.update_layout(title_text="Retention by first-seen cohort",
+                              annotations=[dict(text='Cohorts are not kept for exports streamed in chunks',
+                                                showarrow=False, xref='paper', yref='paper', x=0.5, y=0.5)])
+            return fig
+        with phase('aggregate'):
+            retention = cohorts.retention(customer_ids, start_date, end_date, config['cohort_freq'])
+            repeat = cohorts.repeat_rentals(customer_ids, start_date, end_date, config['cohort_freq'])
 
-    fig.add_trace(go.Scatter(x=df['date'].values, y=df['fee'].values, fill=None, mode='lines+markers',
-                             name='fees', line={'color': 'orange'}))
+        labels = ['{cohort:%Y-%m-%d}: {customers} customers, {rate:.0%} repeat'.format(
+            cohort=cohort, customers=repeat.at[cohort, 'customers'], rate=repeat.at[cohort, 'repeat_rate'])
+            for cohort in retention.index]
 
-    fig.add_trace(go.Scatter(x=df['date'].values, y=df['amount_refunded'].values, fill=None, mode='lines+markers',
-                             name='amount_refunded', line={'color': 'tomato'}))
+        fig = unstyled_figure()
+        fig.add_trace(go.Heatmap(x=list(retention.columns), y=labels, z=(100 * retention).round(1).values,
+                                 colorscale='Greens', zmin=0, zmax=100, colorbar=dict(title='%'),
+                                 hovertemplate='%{y}<br>day %{x}: %{z}% active<extra></extra>'))
 
-    fig.add_trace(go.Scatter(x=df['date'].values, y=df['amount'].values, fill=revenue_filler, mode='lines+markers',
-                             name='on hold', line={'color': 'green'}))
+        fig.update_layout(title_text="Retention by first-seen cohort",
+                          xaxis_title=u"days since first seen", yaxis=dict(autorange='reversed'))
+        return fig
 
-    fig.update_yaxes(tick0=-0.5)
+    return app
 
-    fig.update_layout(template=PLOTLY_THEME, title_text="Raw money streams by day", xaxis_title=u"date")
-
-    return fig
-
-
-@app.callback(Output(component_id='margin-graph', component_property='figure'),
-              [Input(component_id='params-store', component_property='children'),
-               Input(component_id='data-store', component_property='data')])
-def update_margin_graph(selected_params: List, df: pd.DataFrame):
-
-    df = pd.DataFrame(df)
-    slice, status, customer_ids = selected_params
-
-    global statuses
-
-    if status == 'Paid' or '':
-
-        status_query = 'status in {status} '.format(status=stringify(status))
-        customer_query = ' customer_id in ({customer_id})'.format(customer_id=customer_ids) if customer_ids != '' else ''
-
-        if 0 not in (len(status_query), len(customer_query)):
-            total_query = status_query + 'and' + customer_query
-        else:
-            total_query = status_query + customer_query
-
-        cleaned_df = df.query(total_query) if total_query != '' else df
-        cleaned_df['revenue'] = cleaned_df['amount'] - cleaned_df['amount_refunded']
-
-        groupped = (cleaned_df.groupby('date')[['fee', 'revenue']].sum()).reset_index()
-
-        if 'mean' in slice:
-
-            if slice == 'mean':
-                fig = go.Figure()
-                fig.update_layout(yaxis_title="$, mean")
-
-            elif slice == 'mean_scooter':
-                groupped = (pd.concat([groupped, N_SCOOTERS], axis=1)).set_index('date')
-                groupped = (groupped[['fee', 'revenue']].div(groupped['n_scooters'], axis=0)).reset_index()
-
-                fig = go.Figure()
-                fig.update_layout(yaxis_title="$ per scooter, mean")
-
-        elif 'gross' in slice:
-
-            if slice == 'gross':
-                fig = go.Figure()
-                fig.update_layout(yaxis_title="$, gross")
-
-            elif slice == 'gross_scooter':
-                groupped = (pd.concat([groupped, N_SCOOTERS], axis=1)).set_index('date')
-                groupped = (groupped[['fee', 'revenue']].div(groupped['n_scooters'], axis=0)).reset_index()
-
-                fig = go.Figure()
-                fig.update_layout(yaxis_title="$ per scooter, gross")
-
-        fig.add_trace(go.Scatter(x=groupped['date'].values, y=groupped['fee'].values, fill=None, mode='lines+markers',
-                                 name='fees', line={'color': 'yellow'}))
-        fig.add_trace(go.Scatter(x=groupped['date'].values, y=groupped['revenue'].values, fill='tonexty', mode='lines+markers',
-                                 name='revenue', line={'color': 'green'}))
-
-    else:
-        fig = go.Figure()
-
-    fig.update_yaxes(tick0=-0.5)
-    fig.update_layout(template=PLOTLY_THEME, title_text="Margin by day", xaxis_title=u"date")
-
-    return fig
 
+# served by `gunicorn dash_app:server`, every worker then loads the data on its first request,
+# serve.py loads it once before forking instead
+app = create_app()
+server = app.server
 
 if __name__ == '__main__':
     app.run_server(debug=True, host='127.0.0.1', port=8887)
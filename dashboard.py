@@ -0,0 +1,378 @@
+"""App factory and callbacks shared by `dash_app` and `dash_app_refactored`.
+
+`create_dashboard` builds the Dash app with everything the two dashboards have in common:
+the data loading on the first request, the HTTP endpoints, the filter controls, the
+dataset refresh, the customer search, the params and the aggregation job callbacks. A
+dashboard module adds its own page around the filter controls and registers its figures
+with `app.figure_callback`.
+
+Params are (status, customer ids, start date, end date, point budget), followed by the
+values of the dashboard's extra inputs.
+"""
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Sequence
+
+# dash specific imports
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+import dash_bootstrap_components as dbc
+
+from figure_cache import FigureCache
+from figure_style import MARKERS_SELECTOR, SCALE_SELECTOR, STYLE_STORE, register_styling, store_id, style_data
+from instrumentation import metrics, register_metrics_endpoint
+from lazy import lazy_import, resolve
+
+# pandas, plotly figures and the data modules are executed by the first request, not by the import
+go = lazy_import('plotly.graph_objects')
+aggregations = lazy_import('aggregations')
+customer_search = lazy_import('customer_search')
+data_store = lazy_import('data_store')
+downsampling = lazy_import('downsampling')
+ingest = lazy_import('ingest')
+jobs = lazy_import('jobs')
+loader = lazy_import('loader')
+refresher = lazy_import('refresher')
+snapshots = lazy_import('snapshots')
+
+# constants and needed options, a config passed to create_app overrides them
+DEFAULT_CONFIG = {
+    'dataset_key': 'staging_data',
+    # None reads loader.DATA_PATH
+    'data_path': None,
+    # a chunk size (rows) streams exports larger than memory straight into the rollup
+    'ingest_chunk_rows': None,
+    'plotly_theme': 'simple_white',
+    'figure_cache_size': 64,
+    # daily series are reduced to a point budget from the graph width: 'lttb', 'min_max' or None for every point
+    'downsampling': 'lttb',
+    # callback latency, payload and cache numbers are always served on /metrics, the panel is opt-in
+    'debug_panel': False,
+    # aggregation job processes, None for jobs.WORKERS
+    'job_workers': None,
+    # poll the export for appended charges
+    'refresh': True,
+    # load the data in create_app (a preloading server forks after it) instead of on the first request
+    'preload': False,
+}
+
+
+def create_dashboard(name: str, config: dict, graphs: Dict[str, bool], page: Callable[[List], List],
+                     extra_inputs: Sequence[Input] = ()) -> dash.Dash:
+    """The dashboard app, its data is loaded by the first request or by `app.load_data()`.
+
+    `graphs` maps the graph ids to whether the y axis scale option applies to them. `page`
+    gets the filter controls and returns the rows of the page. The figure cache, job
+    queue and refresher are attributes of the returned app.
+    """
+    started = time.perf_counter()
+    key = config['dataset_key']
+
+    # the layout is built on the first page load, there is none to validate the callbacks against before
+    app = dash.Dash(name=name, external_stylesheets=[dbc.themes.FLATLY], suppress_callback_exceptions=True)
+    server = app.server
+    figure_cache = FigureCache(maxsize=config['figure_cache_size'])
+    app.figure_cache = figure_cache
+    metrics.register_cache('figure', figure_cache.stats)
+    app.job_queue = None
+    app.refresher = None
+    load_lock = threading.Lock()
+
+    def load_data() -> None:
+        with load_lock:
+            if app.job_queue is not None:
+                return
+            load_started = time.perf_counter()
+            resolve(go, aggregations, customer_search, data_store, downsampling, ingest, jobs, loader, refresher,
+                    snapshots)
+
+            data_path = config['data_path'] or loader.DATA_PATH
+            # the refresher continues from the bytes loaded, rows written meanwhile are appended by it
+            sizes = ingest.export_sizes(data_path)
+            dataset = ingest.load_dataset(key, data_path, chunk_rows=config['ingest_chunk_rows'], sizes=sizes)
+            # built here rather than by the first keystroke, appends only extend it
+            customer_search.index_for(dataset)
+            if config['refresh']:
+                app.refresher = refresher.Refresher(key, data_path, offsets=sizes)
+                app.refresher.start()
+            app.job_queue = jobs.JobQueue(workers=config['job_workers'] or jobs.WORKERS)
+            metrics.record_startup('load', time.perf_counter() - load_started)
+
+    app.load_data = load_data
+    first_request = {}
+
+    def start_first_request() -> None:
+        first_request['started'] = time.perf_counter()
+        load_data()
+
+    def finish_first_request(response):
+        if 'started' in first_request and 'seconds' not in first_request:
+            first_request['seconds'] = time.perf_counter() - first_request['started']
+            metrics.record_startup('first_request', first_request['seconds'])
+        return response
+
+    # ahead of Dash's own set up, which builds the layout
+    server.before_first_request_funcs.insert(0, start_first_request)
+    server.after_request(finish_first_request)
+
+    # new charges are appended from the data directory or through POST /api/charges
+    server.add_url_rule('/api/charges', 'append_charges', lambda: refresher.append_charges(key), methods=['POST'])
+    # the plotted daily metrics for other teams, as json, csv or arrow with conditional requests
+    server.add_url_rule('/api/daily', 'daily_snapshot', lambda: snapshots.serve_snapshot(key))
+    register_metrics_endpoint(server)
+
+    def filter_controls() -> List:
+        # options come from the rollup instead of scanning the rows
+        rollup = data_store.get_rollup(key)
+        dates = rollup.dates()
+        # an export without charges yet has no dates to bound the picker with
+        date_bounds = {}
+        if len(dates):
+            start_date, end_date = aggregations.default_range(dates)
+            date_bounds = dict(min_date_allowed=dates.min().date(), max_date_allowed=dates.max().date(),
+                               start_date=start_date.date(), end_date=end_date.date())
+
+        return [
+            dbc.FormGroup(
+                [
+                    dbc.Label("Transaction status", id='status-selector-header'),
+                    dcc.Dropdown(
+                        id="status-selector",
+                        options=[{"label": col, "value": col} for col in rollup.statuses()],
+                        value="Paid",
+                    ),
+                    dbc.Tooltip('Select status to drill into statistics.', target="status-selector-header"),
+
+                ]
+            ),
+            dbc.FormGroup(
+                [
+                    dbc.Label("Customer ID", id='customer-id-selector-header'),
+                    dcc.Dropdown(
+                        id="customer-id-selector",
+                        options=[], placeholder="Type to search customers...",
+                        value="", multi=True,
+                    ),
+                    dbc.Tooltip('Multiple selection of customers makes it possible to track a set of '
+                                'customers over time.', target="customer-id-selector-header"),
+                ]
+            ),
+            dbc.FormGroup(
+                [
+                    dbc.Label("Dates", id='date-range-selector-header'),
+                    dcc.DatePickerRange(
+                        id="date-range-selector",
+                        display_format='YYYY-MM-DD', **date_bounds,
+                    ),
+                    dbc.Tooltip('Only the selected dates are read, by default the last 30 days of data.',
+                                target="date-range-selector-header"),
+                ]
+            ),
+            # dbc.FormGroup(
+            #     [
+            #         dbc.Label("Disputed or not "),
+            #         dcc.Dropdown(
+            #             id="disputes-selector",
+            #             options=[{"label": col, "value": col} for col in data['customer_id'].unique()],
+            #             value="Not disputed",
+            #         ),
+            #     ]
+            # ),
+            dbc.FormGroup(
+                [
+                    dbc.Label("Display", id='display-header'),
+                    dbc.RadioItems(
+                        id=SCALE_SELECTOR,
+                        options=[{"label": 'Linear', "value": 'linear'}, {"label": 'Log', "value": 'log'}],
+                        value='linear', inline=True,
+                    ),
+                    dbc.Checklist(
+                        id=MARKERS_SELECTOR,
+                        options=[{"label": 'Markers', "value": 'markers'}],
+                        value=['markers'], inline=True, switch=True,
+                    ),
+                    dbc.Tooltip('The y axis scale and markers are applied in the browser, changing them '
+                                'does not reload the data.', target="display-header"),
+                ]
+            ),
+            dbc.FormGroup(
+                [
+                    html.Small(id='job-status', className='text-muted'),
+                    dbc.Button("Cancel", id='cancel-button', size='sm', color='link'),
+                ]
+            ),
+            dcc.Store(id='request-store'),
+            dcc.Store(id='job-store'),
+            dcc.Interval(id='job-interval', interval=jobs.POLL_MILLISECONDS, disabled=True),
+            dcc.Store(id='params-store'),
+            dcc.Store(id='graph-width-store'),
+            dcc.Store(id=STYLE_STORE, data=style_data(config['plotly_theme'])),
+            *[dcc.Store(id=store_id(graph_id)) for graph_id in graphs],
+            dcc.Store(id='data-store', data=data_store.handle(key)),
+            dcc.Interval(id='refresh-interval', interval=refresher.REFRESH_SECONDS * 1000),
+        ]
+
+    def serve_layout():
+        load_data()
+
+        # per-callback means refreshed on every refresh tick
+        debug_panel = [dbc.Row(dbc.Col(html.Pre(id='debug-panel')))] if config['debug_panel'] else []
+
+        # general layout
+        return dbc.Container(page(filter_controls()) + debug_panel, fluid=True)
+
+    app.layout = serve_layout
+
+    # the width of the daily graphs sets their point budget, it is re-read on every refresh tick
+    app.clientside_callback(
+        """
+        function(n_intervals, width) {
+            var graph = document.getElementById('qty-graph');
+            var current = graph && graph.offsetWidth ? graph.offsetWidth : Math.round(window.innerWidth * 5 / 12);
+            return current === width ? window.dash_clientside.no_update : current;
+        }
+        """,
+        Output(component_id='graph-width-store', component_property='data'),
+        [Input(component_id='refresh-interval', component_property='n_intervals')],
+        [State(component_id='graph-width-store', component_property='data')],
+    )
+
+    # figures come from the server without a template, it is applied in the browser with the display options
+    for graph_id, scalable in graphs.items():
+        register_styling(app, graph_id, scalable)
+
+    @app.callback([Output(component_id='data-store', component_property='data'),
+                   Output(component_id='status-selector', component_property='options'),
+                   Output(component_id='date-range-selector', component_property='max_date_allowed')],
+                  [Input(component_id='refresh-interval', component_property='n_intervals')],
+                  [State(component_id='data-store', component_property='data')])
+    @metrics.instrumented
+    def refresh_dataset(n_intervals: int, dataset: dict):
+
+        # figures and options only change when appended charges bumped the dataset version,
+        # a client served newer charges by another server process is never moved back
+        if not data_store.catch_up(dataset):
+            raise PreventUpdate
+        current = data_store.handle(key)
+        if dataset == current:
+            raise PreventUpdate
+
+        rollup = data_store.get_rollup(key)
+        dates = rollup.dates()
+        max_date = dates.max().date() if len(dates) else dash.no_update
+        return current, [{"label": col, "value": col} for col in rollup.statuses()], max_date
+
+    @app.callback(Output(component_id='customer-id-selector', component_property='options'),
+                  [Input(component_id='customer-id-selector', component_property='search_value')],
+                  [State(component_id='customer-id-selector', component_property='value'),
+                   State(component_id='data-store', component_property='data')])
+    @metrics.instrumented
+    def search_customers(search_value: str, selected: List[str], dataset: dict):
+
+        # an emptied search box keeps the current options, so the selected customers stay visible
+        if not search_value:
+            raise PreventUpdate
+
+        selected = list(selected or [])
+        found = customer_search.index_for(dataset).search(search_value, limit=customer_search.SEARCH_LIMIT)
+        return [{"label": col, "value": col} for col in selected + [i for i in found if i not in selected]]
+
+    @app.callback(Output(component_id='request-store', component_property='data'),
+                  [Input(component_id='status-selector', component_property='value'),
+                   Input(component_id='customer-id-selector', component_property='value'),
+                   Input(component_id='date-range-selector', component_property='start_date'),
+                   Input(component_id='date-range-selector', component_property='end_date'),
+                   Input(component_id='graph-width-store', component_property='data')] + list(extra_inputs))
+    @metrics.instrumented
+    def collect_params(status: str, customer_ids: List[str], start_date: str, end_date: str, graph_width: int,
+                       *extra):
+
+        # filters stay structured values, they are resolved through row and rollup indexes
+        customer_ids = sorted(customer_ids or [])
+        points = downsampling.max_points(graph_width) if config['downsampling'] else None
+        params = (status, customer_ids, start_date, end_date, points) + extra
+        return params
+
+    @app.callback([Output(component_id='params-store', component_property='data'),
+                   Output(component_id='job-store', component_property='data'),
+                   Output(component_id='job-interval', component_property='disabled'),
+                   Output(component_id='job-status', component_property='children')],
+                  [Input(component_id='request-store', component_property='data'),
+                   Input(component_id='data-store', component_property='data'),
+                   Input(component_id='job-interval', component_property='n_intervals'),
+                   Input(component_id='cancel-button', component_property='n_clicks')],
+                  [State(component_id='job-store', component_property='data')])
+    @metrics.instrumented
+    def run_aggregation(requested_params: List, dataset: dict, n_intervals: int, n_clicks: int, job: dict):
+
+        # aggregations run in the job queue, the figures only get the params once their aggregates are cached
+        triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+        if requested_params is None or ('job-interval.n_intervals' in triggered and not job):
+            raise PreventUpdate
+
+        if 'cancel-button.n_clicks' in triggered:
+            if job:
+                app.job_queue.cancel(job['id'])
+            return dash.no_update, None, True, 'Cancelled'
+
+        previous = None
+        if 'job-interval.n_intervals' in triggered:
+            state = app.job_queue.poll(job['id']) if job['id'] else {'state': 'unknown'}
+        else:
+            previous, job, state = job, {'id': None, 'params': requested_params}, {'state': 'unknown'}
+
+        # a new request, or a job another server process accepted, is submitted in this one
+        if state['state'] == 'unknown' and data_store.catch_up(dataset):
+            status, customer_ids, start_date, end_date = job['params'][:4]
+            job = dict(job, id=app.job_queue.submit(dataset, status, customer_ids, start_date, end_date))
+            state = app.job_queue.poll(job['id'], jobs.INLINE_SECONDS) if job['id'] else {'state': 'done'}
+        if previous:
+            # a new request gives up the previous one, its result would be stale
+            app.job_queue.cancel(previous['id'])
+
+        if state['state'] == 'done':
+            return job['params'], None, True, ''
+        if state['state'] in ('failed', 'cancelled'):
+            return dash.no_update, None, True, 'Aggregation {state}'.format(state=state['state'])
+        if state['state'] == 'unknown':
+            # the client saw charges this process has not read yet
+            return dash.no_update, job, False, 'Waiting for the latest charges'
+        message = 'Aggregating: {state}, {seconds:.0f} s'.format(**state)
+        if state.get('ahead'):
+            message += ', {ahead} jobs ahead'.format(**state)
+        return dash.no_update, job, False, message
+
+    def figure_callback(graph_id: str) -> Callable:
+        """Register an `update(selected_params, dataset)` function drawing `graph_id`."""
+        def register(update: Callable) -> Callable:
+            @functools.wraps(update)
+            def guarded(selected_params: List, dataset: dict):
+                # params are released once their aggregates are cached, here too once this process has their charges
+                if selected_params is None or not data_store.catch_up(dataset):
+                    raise PreventUpdate
+                return update(selected_params, dataset)
+
+            app.callback(Output(component_id=store_id(graph_id), component_property='data'),
+                         [Input(component_id='params-store', component_property='data')],
+                         [State(component_id='data-store', component_property='data')])(
+                metrics.instrumented(figure_cache.cached(guarded)))
+            return update
+
+        return register
+
+    app.figure_callback = figure_callback
+
+    if config['debug_panel']:
+        @app.callback(Output(component_id='debug-panel', component_property='children'),
+                      [Input(component_id='refresh-interval', component_property='n_intervals')])
+        def update_debug_panel(n_intervals: int):
+            return metrics.report()
+
+    metrics.record_startup('create_app', time.perf_counter() - started)
+    if config['preload']:
+        load_data()
+    return app
@@ -0,0 +1,153 @@
+"""Server-side registry of the datasets the dashboards plot.
+
+Frames stay in the process, the browser only keeps a small handle
+({'key': ..., 'version': ...}) inside `dcc.Store` and callbacks resolve it back.
+Every dataset is registered together with its per-(date, status, customer) rollup,
+its customer cohorts and its status/customer row-position index. Datasets streamed from exports larger
+than memory are registered with their rollup only and have no raw frame and no cohorts.
+
+Versions are derived from the data where it allows: a dataset loaded from an export is
+registered under the export's size in bytes and the refresher appends under the bytes
+it has read, so server processes holding the same charges report the same version. A
+process behind a client's version (another process served the client newer charges)
+polls its source through `catch_up` before answering.
+
+The raw charges are held as `Charges` segments: an append adds the new rows as a
+segment and indexes only those, so its cost follows the batch and not the history,
+and the loaded frame is never copied.
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import pandas as pd
+
+from cohorts import Cohorts
+from filters import ChargeIndex
+from fleet import FleetSize
+from loader import Charges
+from rollup import Rollup
+
+_datasets: Dict[str, Optional[Charges]] = {}
+_rollups: Dict[str, Rollup] = {}
+_cohorts: Dict[str, Optional[Cohorts]] = {}
+_indexes: Dict[str, Optional[ChargeIndex]] = {}
+_versions: Dict[str, int] = {}
+_pollers: Dict[str, Callable[[], int]] = {}
+_lock = threading.Lock()
+
+
+def _reset_lock() -> None:
+    global _lock
+    _lock = threading.Lock()
+
+
+# forked aggregation workers see the datasets between two appends, never half-way through one
+os.register_at_fork(before=lambda: _lock.acquire(), after_in_parent=lambda: _lock.release(),
+                    after_in_child=_reset_lock)
+
+
+def _next_version(key: str, version: Optional[int]) -> int:
+    # a version derived from the data is used as is, unless it would not move forward
+    return max(_versions.get(key, 0) + 1, version or 0)
+
+
+def register(key: str, df: Optional[pd.DataFrame], rollup: Optional[Rollup] = None,
+             cohorts: Optional[Cohorts] = None, version: Optional[int] = None) -> dict:
+    """Store (or replace) a dataset under `key` and return its new handle."""
+    if df is None and rollup is None:
+        raise ValueError('dataset {key} needs a frame or a rollup'.format(key=key))
+    rollup = rollup if rollup is not None else Rollup.from_frame(df)
+    if cohorts is None and df is not None:
+        cohorts = Cohorts.from_frame(df)
+    charges = Charges([df]) if df is not None else None
+    index = ChargeIndex.from_charges(charges) if charges is not None else None
+    with _lock:
+        _datasets[key] = charges
+        _rollups[key] = rollup
+        _cohorts[key] = cohorts
+        _indexes[key] = index
+        _versions[key] = _next_version(key, version)
+        return {'key': key, 'version': _versions[key]}
+
+
+def handle(key: str) -> dict:
+    with _lock:
+        if key not in _datasets:
+            raise KeyError('dataset {key} is not registered'.format(key=key))
+        return {'key': key, 'version': _versions[key]}
+
+
+def version(key: str) -> int:
+    with _lock:
+        return _versions.get(key, 0)
+
+
+def append(key: str, rows: pd.DataFrame, version: Optional[int] = None) -> dict:
+    """Add new charge rows to a registered dataset, its rollup and cohorts are updated incrementally."""
+    with _lock:
+        if key not in _datasets:
+            raise KeyError('dataset {key} is not registered'.format(key=key))
+        _rollups[key].update(rows)
+        if _cohorts[key] is not None:
+            _cohorts[key].update(rows)
+        if _datasets[key] is not None:
+            # new objects are swapped in, readers keep the table and index they resolved
+            _datasets[key] = _datasets[key].appended(rows)
+            _indexes[key] = ChargeIndex.from_charges(_datasets[key], _indexes[key])
+        _versions[key] = _next_version(key, version)
+        return {'key': key, 'version': _versions[key]}
+
+
+def set_poller(key: str, poll: Callable[[], int]) -> None:
+    """Source poll (a refresher's) `catch_up` runs for `key`."""
+    with _lock:
+        _pollers[key] = poll
+
+
+def catch_up(dataset: Optional[dict]) -> bool:
+    """Whether this process holds the version of a handle or a later one, polling the source first when behind."""
+    if not dataset or version(dataset['key']) >= dataset['version']:
+        return True
+    with _lock:
+        poll = _pollers.get(dataset['key'])
+    if poll is not None:
+        poll()
+    return version(dataset['key']) >= dataset['version']
+
+
+def set_fleet(key: str, fleet: FleetSize) -> dict:
+    """Swap the fleet size table of a dataset's rollup, a new version because the per-scooter metrics change."""
+    with _lock:
+        if key not in _rollups:
+            raise KeyError('dataset {key} is not registered'.format(key=key))
+        _rollups[key].set_fleet(fleet)
+        _versions[key] += 1
+        return {'key': key, 'version': _versions[key]}
+
+
+def snapshot(dataset: Union[dict, str]) -> Tuple[Optional[Charges], Optional[ChargeIndex], Rollup]:
+    """Charges, index and rollup of a dataset as of one moment, no append falls between them."""
+    key = dataset['key'] if isinstance(dataset, dict) else dataset
+    with _lock:
+        if key not in _datasets:
+            raise KeyError('dataset {key} is not registered'.format(key=key))
+        return _datasets[key], _indexes[key], _rollups[key]
+
+
+def get_rollup(dataset: Union[dict, str]) -> Rollup:
+    key = dataset['key'] if isinstance(dataset, dict) else dataset
+    with _lock:
+        if key not in _rollups:
+            raise KeyError('dataset {key} is not registered'.format(key=key))
+        return _rollups[key]
+
+
+def get_cohorts(dataset: Union[dict, str]) -> Optional[Cohorts]:
+    """Resolve a handle (or a bare key) to the dataset's cohorts, None for streamed datasets."""
+    key = dataset['key'] if isinstance(dataset, dict) else dataset
+    with _lock:
+        if key not in _cohorts:
+            raise KeyError('dataset {key} is not registered'.format(key=key))
+        return _cohorts[key]
+
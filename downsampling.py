@@ -0,0 +1,92 @@
+"""Server-side downsampling of long series before they are sent to the browser.
+
+A graph a few hundred pixels wide cannot show more than a couple of points per pixel,
+so daily series are reduced to a point budget derived from the graph's width, either
+with largest-triangle-three-buckets (keeps the visual shape) or min/max bucketing (keeps
+every extreme). Series longer than `WEBGL_THRESHOLD` are drawn with `Scattergl`. Payload
+size and render time then follow the graph width, not the length of the history.
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+PIXELS_PER_POINT = 2
+# widths are rounded to this many points, so resizing a window does not defeat the figure cache
+POINTS_STEP = 50
+DEFAULT_WIDTH = 800
+WEBGL_THRESHOLD = 1000
+METHODS = ['lttb', 'min_max']
+
+
+def max_points(width: Optional[float]) -> int:
+    """Point budget of a graph `width` pixels wide."""
+    points = int((width or DEFAULT_WIDTH) / PIXELS_PER_POINT)
+    return max(POINTS_STEP, points - points % POINTS_STEP)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Positions kept by largest-triangle-three-buckets, first and last point included."""
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    # the points between the first and the last one are split into points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    kept = np.empty(points, dtype=np.intp)
+    kept[0], kept[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(points - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        following = slice(stop, edges[bucket + 2] if bucket + 2 < len(edges) else n)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+
+        # the point spanning the largest triangle with the last kept one and the next bucket's mean
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def min_max(y: np.ndarray, points: int) -> np.ndarray:
+    """Positions of the minimum and the maximum of `points` / 2 equal buckets."""
+    n = len(y)
+    if points >= n or points < 2:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, points // 2 + 1).astype(np.intp)
+    kept = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            kept += [start + int(np.argmin(y[start:stop])), start + int(np.argmax(y[start:stop]))]
+    return np.unique(kept)
+
+
+def downsample(x, y, points: int, method: str = 'lttb'):
+    """At most `points` of the (x, y) series, x may be numbers or dates."""
+    x = pd.Index(x)
+    y = np.asarray(y)
+    if len(x) <= points:
+        return x, y
+
+    numeric_x = x.asi8.astype(np.float64) if isinstance(x, pd.DatetimeIndex) else np.asarray(x, dtype=np.float64)
+    # dates without a value (per scooter metrics missing a fleet size) never win a bucket
+    numeric_y = np.nan_to_num(y.astype(np.float64))
+
+    if method == 'min_max':
+        kept = min_max(numeric_y, points)
+    else:
+        kept = lttb(numeric_x, numeric_y, points)
+    return x[kept], y[kept]
+
+
+def scatter(x, y, points: Optional[int] = None, method: str = 'lttb', **trace) -> go.Scatter:
+    """A line trace downsampled to `points` (None keeps every point), WebGL for long series."""
+    if points:
+        x, y = downsample(x, y, points, method)
+    # the browser draws the downsampled points, a short series stays SVG
+    trace_type = go.Scattergl if len(x) > WEBGL_THRESHOLD else go.Scatter
+    return trace_type(x=x, y=y, **trace)
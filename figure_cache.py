@@ -0,0 +1,68 @@
+"""Bounded LRU cache of rendered figures.
+
+Figures are keyed by the callback name, the normalized params and the dataset version,
+so switching back to an already seen status/slice skips aggregation and figure building.
+"""
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from instrumentation import record_cache
+
+
+def normalize(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+    return value
+
+
+class FigureCache:
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key in self._figures:
+                self.hits += 1
+                self._figures.move_to_end(key)
+                return self._figures[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, figure) -> None:
+        with self._lock:
+            self._figures[key] = figure
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.maxsize:
+                self._figures.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._figures.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._figures), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def cached(self, func: Callable) -> Callable:
+        """Wrap an `update_*_graph(selected_params, dataset)` callback."""
+        @functools.wraps(func)
+        def wrapper(selected_params, dataset):
+            # the dataset handle carries its version, a refreshed dataset never hits stale figures
+            key = (func.__name__, normalize(selected_params), normalize(dataset))
+            figure = self.get(key)
+            record_cache('figure', figure is not None)
+            if figure is None:
+                figure = func(selected_params, dataset)
+                self.put(key, figure)
+            return figure
+
+        return wrapper
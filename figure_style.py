@@ -0,0 +1,68 @@
+"""Figure styling applied in the browser.
+
+Server callbacks write the traces and the data dependent layout of a figure into a
+`dcc.Store` named after its graph (`qty-graph-store` for `qty-graph`), without a
+plotly template: the inlined template is about 9 KB of every figure. A clientside
+callback per graph renders the store with the template, sent once in the layout, and
+the display options (y axis scale, markers). Changing a display option restyles the
+figures in the browser without a request, and a new selection only transfers data.
+
+Dash 1.x has no `Patch` for partial figure updates, the clientside callbacks replace it.
+"""
+import functools
+
+from dash.dependencies import Input, Output
+
+from lazy import lazy_import
+
+go = lazy_import('plotly.graph_objects')
+pio = lazy_import('plotly.io')
+
+STYLE_STORE = 'figure-style-store'
+SCALE_SELECTOR = 'yaxis-scale-selector'
+MARKERS_SELECTOR = 'markers-selector'
+
+# SCALABLE is replaced by true or false, a y axis of shares or a heatmap keeps its scale
+STYLE_FIGURE = """
+function(figure, style, scale, markers) {
+    if (!figure || !style) {
+        return window.dash_clientside.no_update;
+    }
+    var layout = Object.assign({}, figure.layout, {template: style.template});
+    if (SCALABLE) {
+        layout.yaxis = Object.assign({}, layout.yaxis, {type: scale || 'linear'});
+    }
+    var mode = markers && markers.length ? 'lines+markers' : 'lines';
+    var data = figure.data.map(function(trace) {
+        return trace.mode ? Object.assign({}, trace, {mode: mode}) : trace;
+    });
+    return {data: data, layout: layout};
+}
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def style_data(theme: str) -> dict:
+    """Data of the style store, the template of `theme`."""
+    return {'template': pio.templates[theme].to_plotly_json()}
+
+
+def unstyled_figure() -> 'go.Figure':
+    """A figure without the default template, the browser applies the theme."""
+    return go.Figure(layout={'template': {}})
+
+
+def store_id(graph_id: str) -> str:
+    return graph_id + '-store'
+
+
+def register_styling(app, graph_id: str, scalable: bool = True) -> None:
+    """Render `graph_id` from its store and the display options in the browser."""
+    app.clientside_callback(
+        STYLE_FIGURE.replace('SCALABLE', 'true' if scalable else 'false'),
+        Output(component_id=graph_id, component_property='figure'),
+        [Input(component_id=store_id(graph_id), component_property='data'),
+         Input(component_id=STYLE_STORE, component_property='data'),
+         Input(component_id=SCALE_SELECTOR, component_property='value'),
+         Input(component_id=MARKERS_SELECTOR, component_property='value')],
+    )
@@ -0,0 +1,91 @@
+"""Row-position indexes for filtering the charge table by status, customer and date.
+
+Filters are passed as structured values and resolved through prebuilt position arrays,
+so there is no query string to parse and the cost follows the number of matching rows,
+not the number of selected customers. A date range alone is answered from per-date
+positions, so rows outside the range are never touched.
+
+The index has one part per segment of the `Charges` table and is never changed once
+built: an append builds the parts of the new segments only and returns a new index
+sharing the others, so a reader keeps a consistent index for as long as it holds it.
+"""
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from loader import Charges
+
+
+class _Part:
+    """Positions of the rows of one segment, numbered from the segment's offset."""
+
+    def __init__(self, rows: pd.DataFrame, offset: int):
+        self.rows = rows
+        self.offset = offset
+
+        self._status_categories = {status: code for code, status in enumerate(pd.unique(rows['status']))}
+        codes = rows['status'].astype(object).map(self._status_categories).fillna(-1)
+        self._status_codes = codes.values.astype(np.int16)
+        self._dates = rows['date'].values.astype('datetime64[ns]')
+        self._status_positions, self._customer_positions, self._date_positions = [
+            {value: local + offset for value, local in rows.groupby(column, sort=False, observed=True).indices.items()}
+            for column in ('status', 'customer_id', 'date')]
+
+    @staticmethod
+    def _in_range(dates: np.ndarray, start=None, end=None) -> np.ndarray:
+        mask = np.ones(len(dates), dtype=bool)
+        if start is not None:
+            mask &= dates >= np.datetime64(pd.Timestamp(start))
+        if end is not None:
+            mask &= dates <= np.datetime64(pd.Timestamp(end))
+        return mask
+
+    def positions(self, status: Optional[str], customer_ids: List[str], start=None, end=None) -> np.ndarray:
+        empty = np.empty(0, dtype=np.intp)
+        dated = start is not None or end is not None
+        if not status and not customer_ids:
+            dates = np.array(list(self._date_positions), dtype='datetime64[ns]')
+            selected = [self._date_positions[pd.Timestamp(date)] for date in dates[self._in_range(dates, start, end)]]
+            return np.sort(np.concatenate(selected)) if selected else empty
+
+        if not customer_ids:
+            positions = self._status_positions.get(status, empty)
+        else:
+            positions = np.concatenate([self._customer_positions.get(customer_id, empty)
+                                        for customer_id in customer_ids])
+            if status:
+                code = self._status_categories.get(status)
+                local = positions - self.offset
+                positions = positions[self._status_codes[local] == code] if code is not None else empty
+            positions = np.sort(positions)
+
+        if dated:
+            positions = positions[self._in_range(self._dates[positions - self.offset], start, end)]
+        return positions
+
+
+class ChargeIndex:
+
+    def __init__(self, parts: List[_Part] = ()):
+        self._parts = list(parts)
+
+    @classmethod
+    def from_charges(cls, charges: Charges, previous: Optional['ChargeIndex'] = None) -> 'ChargeIndex':
+        """Index of `charges`, reusing the parts `previous` built for the same segments."""
+        known = {(id(part.rows), part.offset): part for part in previous._parts} if previous is not None else {}
+        parts = []
+        for segment, offset in zip(charges.segments, charges.offsets):
+            part = known.get((id(segment), offset))
+            parts.append(part if part is not None and part.rows is segment else _Part(segment, int(offset)))
+        return cls(parts)
+
+    def positions(self, status: Optional[str], customer_ids: Iterable[str],
+                  start=None, end=None) -> Optional[np.ndarray]:
+        """Sorted row positions matching the filter, None when nothing is filtered."""
+        customer_ids = list(customer_ids)
+        if not status and not customer_ids and start is None and end is None:
+            return None
+        # parts are ordered by offset, so their sorted positions concatenate sorted
+        selected = [part.positions(status, customer_ids, start, end) for part in self._parts]
+        return np.concatenate(selected) if selected else np.empty(0, dtype=np.intp)
@@ -0,0 +1,41 @@
+"""Fleet size (scooters on the street) per date for the per-scooter metrics.
+
+The table is read from `data/fleet_size.csv` (columns `date`, `n_scooters`). Until that
+export exists a placeholder of 5-10 scooters per date is derived from a hash of the date,
+so every worker and every refresh sees the same value for the same day.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+FLEET_PATH = 'data/fleet_size.csv'
+PLACEHOLDER_MIN, PLACEHOLDER_MAX = 5, 10
+
+
+def load_fleet(path: str = FLEET_PATH) -> Optional[pd.Series]:
+    if not os.path.exists(path):
+        return None
+    fleet = pd.read_csv(path, parse_dates=['date'])
+    return fleet.groupby('date')['n_scooters'].last().astype(np.float64)
+
+
+class FleetSize:
+
+    def __init__(self, table: Optional[pd.Series] = None):
+        self.table = table
+
+    @classmethod
+    def load(cls, path: str = FLEET_PATH) -> 'FleetSize':
+        return cls(load_fleet(path))
+
+    def lookup(self, dates) -> np.ndarray:
+        """Scooter count for every date, NaN for dates missing from a loaded table."""
+        dates = pd.DatetimeIndex(dates)
+        if self.table is not None:
+            return self.table.reindex(dates).values
+
+        spread = PLACEHOLDER_MAX - PLACEHOLDER_MIN + 1
+        hashes = pd.util.hash_pandas_object(pd.Series(dates), index=False).values
+        return (PLACEHOLDER_MIN + hashes % spread).astype(np.float64)
@@ -0,0 +1,99 @@
+"""Chunked ingestion of charge exports larger than memory.
+
+A single CSV or a directory of (daily) export files is read in bounded batches and every
+batch is folded into a `Rollup`, which holds everything the four charts need. The raw
+charge table is never materialized, so peak memory follows the batch size and the
+aggregates rather than the length of the history.
+
+Customer cohorts are left out: they keep every (customer, date) key and reservation of
+the history, which cannot be forgotten like the rollup's dates, so a streamed dataset
+has no retention figure.
+
+The distinct-count keys of a date can only be dropped once no later row has that date,
+which is proven while the export is sorted by date. Dates are forgotten as long as it
+is; an export found out of order after some were forgotten is folded again from the
+start, keeping every date's keys.
+"""
+import glob
+import os
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+import data_store
+from loader import CSV_DTYPES, complete_size, concat_charges, load_charges, open_prefix, optimize
+from rollup import Rollup
+
+CHUNK_ROWS = 100000
+
+
+def export_paths(source: str) -> List[str]:
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '*.csv')))
+    return [source]
+
+
+def export_sizes(source: str) -> Dict[str, int]:
+    """Bytes of each export file up to its last complete line, the part of it that is loaded.
+
+    A dataset loaded from them is registered under their sum as its version, and its
+    refresher continues from them.
+    """
+    return {path: complete_size(path) for path in export_paths(source)}
+
+
+def iter_chunks(source: str, chunk_rows: int = CHUNK_ROWS,
+                sizes: Optional[Dict[str, int]] = None) -> Iterator[pd.DataFrame]:
+    sizes = sizes if sizes is not None else export_sizes(source)
+    for path, size in sizes.items():
+        with open_prefix(path, size) as export:
+            for chunk in pd.read_csv(export, chunksize=chunk_rows, dtype=CSV_DTYPES):
+                yield optimize(chunk)
+
+
+def _fold(source: str, sizes: Dict[str, int], chunk_rows: int, rollup: Rollup, forget: bool) -> bool:
+    """Fold every batch in, False when rows arrive out of date order after a date was forgotten."""
+    newest, forgotten = None, False
+    for chunk in iter_chunks(source, chunk_rows, sizes):
+        dates = chunk['date']
+        if forget and not (dates.is_monotonic_increasing and (newest is None or dates.min() >= newest)):
+            if forgotten:
+                return False
+            forget = False
+        newest = dates.max() if newest is None else max(newest, dates.max())
+
+        rollup.update(chunk)
+        if forget:
+            # the export is sorted so far, earlier dates cannot receive rows anymore
+            rollup.forget_before(newest)
+            forgotten = True
+    return True
+
+
+def ingest(source: str, chunk_rows: int = CHUNK_ROWS, rollup: Optional[Rollup] = None,
+           sizes: Optional[Dict[str, int]] = None) -> Rollup:
+    """Fold an export (file or directory) into an empty rollup batch by batch."""
+    rollup = rollup if rollup is not None else Rollup()
+    # both passes read the same bytes, whatever is appended meanwhile
+    sizes = sizes if sizes is not None else export_sizes(source)
+    if not _fold(source, sizes, chunk_rows, rollup, forget=True):
+        rollup = Rollup(rollup.fleet)
+        _fold(source, sizes, chunk_rows, rollup, forget=False)
+    return rollup
+
+
+def load_dataset(key: str, source: str, chunk_rows: Optional[int] = None,
+                 sizes: Optional[Dict[str, int]] = None) -> dict:
+    """Register `source` under `key`, streamed into a rollup only when `chunk_rows` is set.
+
+    Only the `sizes` bytes of its files are read, `export_sizes` by default. The files of a
+    directory are loaded one by one (each with its own cache) and concatenated.
+    """
+    sizes = sizes if sizes is not None else export_sizes(source)
+    version = sum(sizes.values())
+    if chunk_rows:
+        return data_store.register(key, None, ingest(source, chunk_rows, sizes=sizes), version=version)
+    if not sizes:
+        raise ValueError('no csv exports found in {source}'.format(source=source))
+    charges = [load_charges(path, size=size) for path, size in sizes.items()]
+    return data_store.register(key, concat_charges(charges), version=version)
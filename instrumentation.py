@@ -0,0 +1,262 @@
+"""Latency, payload and cache instrumentation of the Dash callbacks.
+
+`metrics.instrumented` wraps a callback and records its wall time, the JSON size of its
+inputs and output and the cache hits and misses of the call. Code running inside a call
+marks its phases with `phase` (the aggregation engine marks filter and aggregate), the
+rest of the callback's time is reported as the figure phase. Measuring the output size
+serializes it once more, that time is reported as the serialize phase.
+
+`record_startup` keeps how long the app took to import, build, load its data and answer
+its first request, and `register_cache` the stats of a cache (its size, capacity, hits
+and misses over all callers) to report with them. `register_metrics_endpoint` serves the
+numbers in the Prometheus text format and `metrics.report` renders them for the optional
+debug panel.
+"""
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import plotly
+from dash import no_update
+from dash.exceptions import PreventUpdate
+from flask import Flask, Response
+
+METRICS_PATH = '/metrics'
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PHASES = ['filter', 'aggregate', 'figure', 'serialize']
+OUTCOMES = ['ok', 'prevented', 'error']
+STARTUP_STEPS = ['import', 'create_app', 'load', 'first_request']
+
+_calls = threading.local()
+
+
+class PayloadEncoder(plotly.utils.PlotlyJSONEncoder):
+    """The encoder Dash uses for its responses, outputs left as `no_update` are not sent."""
+
+    def default(self, obj):
+        if obj is no_update:
+            return None
+        return super().default(obj)
+
+
+def payload_bytes(value) -> int:
+    return len(json.dumps(value, cls=PayloadEncoder))
+
+
+def _stack() -> List[dict]:
+    if not hasattr(_calls, 'stack'):
+        _calls.stack = []
+    return _calls.stack
+
+
+@contextmanager
+def phase(name: str):
+    """Add the time spent in the block to `name` of the running callback, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stack = _stack()
+        if stack:
+            stack[-1]['phases'][name] += time.perf_counter() - start
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    stack = _stack()
+    if stack:
+        stack[-1]['cache'][cache, 'hit' if hit else 'miss'] += 1
+
+
+class CallbackStats:
+
+    def __init__(self):
+        self.outcomes = defaultdict(int)
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.phases = defaultdict(float)
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.cache = defaultdict(int)
+
+    @property
+    def calls(self) -> int:
+        return sum(self.outcomes.values())
+
+
+class Metrics:
+
+    def __init__(self, measure_payloads: bool = True):
+        self.measure_payloads = measure_payloads
+        self._stats: Dict[str, CallbackStats] = {}
+        self._startup: Dict[str, float] = {}
+        self._caches: Dict[str, Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, name: str, call: dict, seconds: float, outcome: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, CallbackStats())
+            stats.outcomes[outcome] += 1
+            stats.seconds += seconds
+            for position, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[position] += 1
+            for phase_name, spent in call['phases'].items():
+                stats.phases[phase_name] += spent
+            stats.input_bytes += call['input_bytes']
+            stats.output_bytes += call['output_bytes']
+            for key, count in call['cache'].items():
+                stats.cache[key] += count
+
+    def instrumented(self, func: Callable) -> Callable:
+        """Wrap a Dash callback, to be placed right under `@app.callback`."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call = {'phases': defaultdict(float), 'cache': defaultdict(int), 'input_bytes': 0, 'output_bytes': 0}
+            stack = _stack()
+            stack.append(call)
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                output = func(*args, **kwargs)
+                outcome = 'ok'
+            except PreventUpdate:
+                outcome = 'prevented'
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                stack.pop()
+                call['phases']['figure'] += max(seconds - sum(call['phases'].values()), 0.0)
+                if outcome == 'ok' and self.measure_payloads:
+                    serialize_start = time.perf_counter()
+                    call['input_bytes'] = payload_bytes([args, kwargs])
+                    call['output_bytes'] = payload_bytes(output)
+                    call['phases']['serialize'] = time.perf_counter() - serialize_start
+                    seconds += call['phases']['serialize']
+                self._record(func.__name__, call, seconds, outcome)
+            return output
+
+        return wrapper
+
+    def record_startup(self, step: str, seconds: float) -> None:
+        with self._lock:
+            self._startup[step] = seconds
+
+    def register_cache(self, cache: str, stats: Callable[[], dict]) -> None:
+        """Report the `size`, `maxsize`, `hits` and `misses` returned by `stats` under `cache`."""
+        with self._lock:
+            self._caches[cache] = stats
+
+    def caches(self) -> Dict[str, dict]:
+        with self._lock:
+            caches = dict(self._caches)
+        return {cache: stats() for cache, stats in sorted(caches.items())}
+
+    def startup(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._startup)
+
+    def snapshot(self) -> Dict[str, CallbackStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def render_prometheus(self) -> str:
+        """All callback metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append('# HELP {name} {help_text}'.format(name=name, help_text=help_text))
+            lines.append('# TYPE {name} {kind}'.format(name=name, kind=kind))
+
+        def sample(name: str, labels: dict, value) -> None:
+            rendered = ','.join('{key}="{value}"'.format(key=key, value=value) for key, value in labels.items())
+            lines.append('{name}{{{labels}}} {value}'.format(name=name, labels=rendered, value=value))
+
+        stats = sorted(self.snapshot().items())
+
+        family('dashboard_callback_seconds', 'histogram', 'Wall time of Dash callbacks.')
+        for callback, item in stats:
+            for bound, count in zip(LATENCY_BUCKETS, item.buckets):
+                sample('dashboard_callback_seconds_bucket', {'callback': callback, 'le': bound}, count)
+            sample('dashboard_callback_seconds_bucket', {'callback': callback, 'le': '+Inf'}, item.calls)
+            sample('dashboard_callback_seconds_sum', {'callback': callback}, item.seconds)
+            sample('dashboard_callback_seconds_count', {'callback': callback}, item.calls)
+
+        family('dashboard_callback_calls_total', 'counter', 'Dash callback calls by outcome.')
+        for callback, item in stats:
+            for outcome in OUTCOMES:
+                sample('dashboard_callback_calls_total', {'callback': callback, 'outcome': outcome},
+                       item.outcomes[outcome])
+
+        family('dashboard_callback_phase_seconds_total', 'counter', 'Time spent per callback phase.')
+        for callback, item in stats:
+            for name in PHASES:
+                sample('dashboard_callback_phase_seconds_total', {'callback': callback, 'phase': name},
+                       item.phases[name])
+
+        family('dashboard_callback_input_bytes_total', 'counter', 'JSON bytes of callback inputs.')
+        for callback, item in stats:
+            sample('dashboard_callback_input_bytes_total', {'callback': callback}, item.input_bytes)
+
+        family('dashboard_callback_output_bytes_total', 'counter', 'JSON bytes of callback outputs.')
+        for callback, item in stats:
+            sample('dashboard_callback_output_bytes_total', {'callback': callback}, item.output_bytes)
+
+        family('dashboard_callback_cache_requests_total', 'counter', 'Cache lookups made by callbacks.')
+        for callback, item in stats:
+            for (cache, result), count in sorted(item.cache.items()):
+                sample('dashboard_callback_cache_requests_total',
+                       {'callback': callback, 'cache': cache, 'result': result}, count)
+
+        family('dashboard_startup_seconds', 'gauge', 'Time taken by the start up steps of the app.')
+        startup = self.startup()
+        for step in STARTUP_STEPS:
+            if step in startup:
+                sample('dashboard_startup_seconds', {'step': step}, startup[step])
+
+        caches = self.caches()
+        family('dashboard_cache_entries', 'gauge', 'Entries held by a cache.')
+        for cache, item in caches.items():
+            sample('dashboard_cache_entries', {'cache': cache}, item['size'])
+        family('dashboard_cache_capacity', 'gauge', 'Entries a cache holds at most.')
+        for cache, item in caches.items():
+            sample('dashboard_cache_capacity', {'cache': cache}, item['maxsize'])
+
+        return '\n'.join(lines) + '\n'
+
+    def report(self) -> str:
+        """Plain text table of the per-callback means for the debug panel."""
+        header = '{:<24} {:>6} {:>9} ' + ' '.join(['{:>10}'] * len(PHASES)) + ' {:>9} {:>9} {:>10}'
+        rows = [header.format('callback', 'calls', 'mean ms', *PHASES, 'in KB', 'out KB', 'cache hit')]
+        for callback, item in sorted(self.snapshot().items()):
+            calls = max(item.calls, 1)
+            hits = sum(count for (cache, result), count in item.cache.items() if result == 'hit')
+            lookups = sum(item.cache.values())
+            rows.append(header.format(
+                callback[:24], item.calls, '{:.1f}'.format(1000 * item.seconds / calls),
+                *['{:.1f}'.format(1000 * item.phases[name] / calls) for name in PHASES],
+                '{:.1f}'.format(item.input_bytes / calls / 1024), '{:.1f}'.format(item.output_bytes / calls / 1024),
+                '{}/{}'.format(hits, lookups)))
+
+        startup = self.startup()
+        rows.append('start up: ' + ', '.join('{step} {ms:.0f} ms'.format(step=step, ms=1000 * startup[step])
+                                             for step in STARTUP_STEPS if step in startup))
+        for cache, item in self.caches().items():
+            rows.append('{cache} cache: {size}/{maxsize} entries, {hits} hits, {misses} misses'.format(
+                cache=cache, **item))
+        return '\n'.join(rows)
+
+
+metrics = Metrics()
+
+
+def register_metrics_endpoint(server: Flask, registry: Metrics = metrics) -> None:
+    """Serve the callback metrics on `GET /metrics` for Prometheus to scrape."""
+
+    def callback_metrics():
+        return Response(registry.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    server.add_url_rule(METRICS_PATH, 'callback_metrics', callback_metrics)
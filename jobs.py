@@ -0,0 +1,166 @@
+"""Aggregation jobs run off the request threads.
+
+An uncached aggregation is submitted to a pool of worker processes (or threads). The
+callback waits `INLINE_SECONDS` for it, so small queries still answer in one round
+trip, and otherwise returns at once while the browser polls the job through a
+`dcc.Interval`. One expensive query then occupies a pool worker, not a request thread
+of the server, and its CPU time is spent in another process.
+
+A job is shared by all clients asking for the same aggregates and cancelled once no
+client waits for it anymore. A client changing its filters gives up its previous job,
+so a stale result is never plotted. Only queued jobs can be cancelled, a running one
+finishes in its worker and its result is still cached.
+
+Worker processes are forked from the server and see the datasets as they were at fork
+time. A worker reports the dataset version it computed on. A result older than the
+requested version is discarded, the pool is replaced (the new workers see the appended
+charges) and the job resubmitted.
+
+Jobs live in one server process. A poll reaching another process (several gunicorn
+workers) finds no job there and reports it as unknown, the callback then submits the
+same aggregation in that process.
+"""
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from typing import Dict, Optional, Sequence, Tuple
+
+import aggregations
+import data_store
+from aggregations import Aggregates
+
+EXECUTOR = 'process'
+WORKERS = 2
+INLINE_SECONDS = 0.25
+POLL_MILLISECONDS = 250
+# finished jobs nobody polled for (a closed tab) are forgotten after this long
+JOB_TTL_SECONDS = 300
+
+
+def _compute(key: tuple) -> Tuple[int, Aggregates]:
+    return data_store.version(key[0]), aggregations.compute(key)
+
+
+def _store(key: tuple, future: Future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    version, result = future.result()
+    if version >= key[1]:
+        aggregations.store(key, result)
+
+
+class Job:
+
+    def __init__(self, key: tuple, future: Future):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.future = future
+        self.submitted = time.monotonic()
+        self.waiting = 1
+        self.pool = None
+
+    def state(self) -> str:
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.done():
+            return 'failed' if self.future.exception() is not None else 'done'
+        return 'running' if self.future.running() else 'queued'
+
+
+class JobQueue:
+
+    def __init__(self, executor: str = EXECUTOR, workers: int = WORKERS):
+        self.executor = executor
+        self.workers = workers
+        self._pool = None
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[tuple, Job] = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, key: tuple) -> Future:
+        if self._pool is None:
+            if self.executor == 'process':
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='aggregation')
+        return self._pool.submit(_compute, key)
+
+    def _finish(self, job: Job) -> None:
+        # later submits find the result in the aggregates cache, clients still polling find the job
+        if self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _forget(self, job: Job) -> None:
+        self._jobs.pop(job.id, None)
+        self._finish(job)
+
+    def submit(self, dataset: dict, status: Optional[str], customer_ids: Optional[Sequence[str]],
+               start=None, end=None) -> Optional[str]:
+        """Id of the job computing these aggregates, None when they are cached already."""
+        key = aggregations.results_key(dataset, status, customer_ids, start, end)
+        if aggregations.cached(key) is not None:
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+            for job in [job for job in self._jobs.values() if now - job.submitted > JOB_TTL_SECONDS]:
+                self._forget(job)
+
+            job = self._by_key.get(key)
+            if job is not None and not job.future.cancelled():
+                job.waiting += 1
+                return job.id
+
+            job = Job(key, self._submit(key))
+            job.pool = self._pool
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            return job.id
+
+    def cancel(self, job_id: str) -> None:
+        """Stop waiting for a job, it is dropped once no client waits for it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.waiting -= 1
+            if job.waiting <= 0:
+                if not job.future.cancel():
+                    job.future.add_done_callback(lambda future, key=job.key: _store(key, future))
+                self._forget(job)
+
+    def poll(self, job_id: str, timeout: float = 0) -> dict:
+        """State of a job after waiting up to `timeout` seconds, its aggregates are cached once done."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return {'state': 'unknown', 'seconds': 0.0}
+
+        try:
+            version, result = job.future.result(timeout)
+        except TimeoutError:
+            with self._lock:
+                ahead = sum(1 for other in self._jobs.values()
+                            if other.submitted < job.submitted and other.state() == 'queued')
+            return {'state': job.state(), 'seconds': time.monotonic() - job.submitted, 'ahead': ahead}
+        except Exception as error:
+            with self._lock:
+                self._finish(job)
+            return {'state': 'cancelled' if job.future.cancelled() else 'failed', 'error': repr(error),
+                    'seconds': time.monotonic() - job.submitted}
+
+        with self._lock:
+            if version < job.key[1]:
+                # the workers were forked before the requested version, fresh ones see it
+                if job.pool is self._pool:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                job.future = self._submit(job.key)
+                job.pool = self._pool
+                return {'state': 'queued', 'seconds': time.monotonic() - job.submitted, 'ahead': 0}
+            self._finish(job)
+
+        aggregations.store(job.key, result)
+        return {'state': 'done', 'seconds': time.monotonic() - job.submitted}
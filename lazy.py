@@ -0,0 +1,31 @@
+"""Deferred imports for the dashboard modules.
+
+`lazy_import` registers a module whose code only runs on its first attribute access,
+so pandas, plotly's figure classes and the data modules are not paid for by a process
+that only imports an app (a gunicorn master reading its config, a worker that never
+serves a request, a test collecting the callbacks). `resolve` runs them up front, from
+one thread: `importlib.util.LazyLoader` is not thread safe before Python 3.12.
+"""
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """`import name`, executed on first use."""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def resolve(*modules: ModuleType) -> None:
+    """Execute lazily imported modules now."""
+    for module in modules:
+        getattr(module, '__file__', None)
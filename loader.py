@@ -0,0 +1,250 @@
+"""Loading of the charge table into a compact, typed frame.
+
+Repetitive strings become categoricals, timestamps are parsed once (with the hour
+derived at load time), so every worker process holding the table needs a fraction of
+the memory of the plain `read_csv` result. Money is held as int32 cents: half the size
+of float64 dollars, and its sums are exact. The rollup converts them back to dollars.
+
+The typed frame is also written once to an uncompressed Arrow (Feather v2) cache next to
+the data. Later starts memory-map that file instead of parsing the CSV, so processes on
+one box share its pages. The cache is invalidated by the source's mtime and size, with
+a content hash as the tie-breaker, and by a change of its format.
+
+An export may be appended to while it is read, so only its bytes up to the last complete
+line are loaded, and the size loaded is what a refresher continues from.
+
+Rows appended later are kept next to the loaded frame in `Charges` segments instead of
+being concatenated to it.
+"""
+import hashlib
+import io
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # the columnar cache is optional, without pyarrow the csv is parsed on every start
+    pa = None
+
+DATA_PATH = 'data/staging_data_cleaned.csv'
+CACHE_DIR = 'data/.cache'
+
+CATEGORICAL_COLUMNS = ['status', 'customer_id', 'reservation_id']
+DATETIME_COLUMNS = ['created_(utc)', 'date']
+MONEY_COLUMNS = ['amount', 'amount_refunded', 'converted_amount_refunded', 'fee']
+CENTS = 100
+# bumped whenever the cached dtypes or layout change, older caches are rebuilt
+CACHE_FORMAT = '4'
+# ids are read as strings, otherwise a batch of numeric-looking ids is inferred as numbers
+CSV_DTYPES = {column: str for column in ['id'] + CATEGORICAL_COLUMNS}
+
+
+def memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def optimize(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a raw charge frame to the compact dtypes."""
+    df = df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype('category')
+    for column in DATETIME_COLUMNS:
+        df[column] = pd.to_datetime(df[column])
+    for column in MONEY_COLUMNS:
+        # an empty amount cannot be held in cents and is rejected like a malformed one
+        cents = (df[column].astype(np.float64) * CENTS).round()
+        if cents.abs().max() > np.iinfo(np.int32).max:
+            raise ValueError('{column} exceeds the int32 cents range'.format(column=column))
+        df[column] = cents.astype(np.int32)
+    df['hour'] = df['created_(utc)'].dt.hour.astype(np.int8)
+    return df
+
+
+def complete_size(path: str) -> int:
+    """Bytes of `path` up to its last complete line, a row still being written is left out."""
+    with open(path, 'rb') as export:
+        end = position = export.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(position - 2 ** 16, 0)
+            export.seek(start)
+            newline = export.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    # a header without its line end is still read whole
+    return end
+
+
+class _Prefix(io.RawIOBase):
+    """The first `size` bytes of an open file."""
+
+    def __init__(self, export, size: int):
+        self._export = export
+        self._left = size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        read = self._export.readinto(memoryview(buffer)[:self._left])
+        self._left -= read
+        return read
+
+    def close(self) -> None:
+        self._export.close()
+        super().close()
+
+
+def open_prefix(path: str, size: int) -> io.BufferedReader:
+    """Binary reader of the first `size` bytes of `path`, streamed rather than read into memory."""
+    return io.BufferedReader(_Prefix(open(path, 'rb'), size))
+
+
+def cache_path(path: str) -> str:
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, name + '.arrow')
+
+
+def _fingerprint(path: str, size: int) -> dict:
+    return {'source_mtime_ns': str(os.stat(path).st_mtime_ns), 'source_size': str(size)}
+
+
+def _sha1(path: str, size: int) -> str:
+    digest = hashlib.sha1()
+    with open_prefix(path, size) as source:
+        for block in iter(lambda: source.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_cache(df: pd.DataFrame, path: str, size: int) -> None:
+    """Cache `df`, parsed from the first `size` bytes of `path`."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({key.encode(): value.encode()
+                     for key, value in dict(_fingerprint(path, size), source_sha1=_sha1(path, size),
+                                            cache_format=CACHE_FORMAT).items()})
+
+    # written aside and renamed, so workers starting together never read a half-written cache
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached = cache_path(path)
+    partial = '{cached}.{pid}.tmp'.format(cached=cached, pid=os.getpid())
+    # a single record batch: columns split over several chunks are copied into pandas on read
+    feather.write_feather(table.replace_schema_metadata(metadata), partial, compression='uncompressed',
+                          chunksize=max(len(df), 1))
+    os.replace(partial, cached)
+
+
+def read_cache(path: str, size: int) -> Optional[pd.DataFrame]:
+    """Typed frame of the first `size` bytes from the memory-mapped cache, None when it is missing or stale."""
+    cached = cache_path(path)
+    if pa is None or not os.path.exists(cached):
+        return None
+
+    table = feather.read_table(cached, memory_map=True)
+    metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+    if metadata.get('cache_format') != CACHE_FORMAT:
+        return None
+    fingerprint = _fingerprint(path, size)
+    stale = any(metadata.get(key) != value for key, value in fingerprint.items())
+
+    if stale and metadata.get('source_sha1') != _sha1(path, size):
+        return None
+
+    # numeric columns stay views on the mapped file where arrow allows it
+    data = table.to_pandas(split_blocks=True)
+    if stale:
+        write_cache(data, path, size)
+    return data
+
+
+def load_charges(path: str = DATA_PATH, verbose: bool = True, use_cache: bool = True,
+                 size: Optional[int] = None) -> pd.DataFrame:
+    """Typed charges of the first `size` bytes of `path`, of its complete lines by default."""
+    start = time.perf_counter()
+    size = complete_size(path) if size is None else size
+    data = read_cache(path, size) if use_cache else None
+
+    if data is not None:
+        if verbose:
+            print('charges loaded from {cached}: {rows} rows, {after:.2f} MB in {seconds:.3f} s'.format(
+                cached=cache_path(path), rows=len(data), after=memory_mb(data),
+                seconds=time.perf_counter() - start))
+        return data
+
+    with open_prefix(path, size) as export:
+        raw = pd.read_csv(export, dtype=CSV_DTYPES)
+    data = optimize(raw)
+    if use_cache and pa is not None:
+        write_cache(data, path, size)
+
+    if verbose:
+        print('charges loaded from {path}: {rows} rows, {before:.2f} MB -> {after:.2f} MB in {seconds:.3f} s'.format(
+            path=path, rows=len(data), before=memory_mb(raw), after=memory_mb(data),
+            seconds=time.perf_counter() - start))
+    return data
+
+
+def concat_charges(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate typed charge frames without falling back to object columns."""
+    typed = frames
+    frames = [frame for frame in frames if len(frame)]
+    if len(frames) <= 1:
+        # a single frame is kept as is (its columns may be memory-mapped from the cache), exports
+        # holding only their header still give the typed columns
+        return frames[0] if frames else typed[0] if typed else pd.DataFrame()
+
+    columns = {}
+    for column in CATEGORICAL_COLUMNS:
+        columns[column] = union_categoricals([frame[column] for frame in frames], ignore_order=True)
+
+    data = pd.concat([frame.drop(columns=CATEGORICAL_COLUMNS) for frame in frames], ignore_index=True)
+    for column in CATEGORICAL_COLUMNS:
+        data[column] = columns[column]
+    return data[frames[0].columns]
+
+
+class Charges:
+    """Typed charge table held as the loaded frame followed by the batches appended to it.
+
+    Appending never copies the rows already held: a batch becomes a new segment, and the
+    trailing appended segments are merged while the older one is not the larger, so
+    there are O(log n) segments and a row is copied O(log n) times. The loaded frame,
+    memory-mapped or shared with forked workers, is never merged. Instances are not
+    changed after construction, `appended` returns a new one.
+    """
+
+    def __init__(self, segments: List[pd.DataFrame]):
+        self.segments = segments
+        self.offsets = np.cumsum([0] + [len(segment) for segment in segments])
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def appended(self, rows: pd.DataFrame) -> 'Charges':
+        if not len(rows):
+            return self
+        segments = self.segments + [rows]
+        while len(segments) > 2 and len(segments[-2]) <= len(segments[-1]):
+            segments[-2:] = [concat_charges(segments[-2:])]
+        return Charges(segments)
+
+    def take(self, positions: Optional[np.ndarray], columns: List[str]) -> pd.DataFrame:
+        """`columns` of the rows at sorted `positions`, of every row when positions is None."""
+        if positions is None:
+            pieces = [segment[columns] for segment in self.segments]
+        else:
+            bounds = np.searchsorted(positions, self.offsets)
+            pieces = [segment.iloc[positions[first:last] - offset, segment.columns.get_indexer(columns)]
+                      for segment, offset, first, last in zip(self.segments, self.offsets, bounds, bounds[1:])
+                      if last > first]
+        if len(pieces) == 1:
+            return pieces[0]
+        # categories differ between segments, the few selected columns fall back to plain values
+        return pd.concat(pieces, ignore_index=True) if pieces else self.segments[0][columns].iloc[:0]
@@ -0,0 +1,124 @@
+"""Live refresh of a registered dataset with append-only increments.
+
+`Refresher` polls the export (a CSV or a directory of CSVs) in a daemon thread and
+parses only the bytes appended since the last poll, new files included. `append_charges`
+is the view of `POST /api/charges` for pushing rows directly. Either way
+the rows go through `data_store.append`, which updates the rollup and indexes with the
+delta and bumps the dataset version the dashboards poll for. A changed fleet size table
+is reloaded by the same poll.
+
+The version of an append is the number of export bytes read so far, so refreshers of
+different server processes reading the same export agree on it. A started refresher is
+also the source `data_store.catch_up` polls when a client is ahead of its process.
+"""
+import io
+import os
+import threading
+from typing import Dict, Optional
+
+import pandas as pd
+from flask import jsonify, request
+
+import data_store
+from fleet import FLEET_PATH, FleetSize
+from ingest import export_paths, export_sizes
+from loader import CSV_DTYPES, optimize
+
+REFRESH_SECONDS = 30
+REQUIRED_COLUMNS = ['id', 'created_(utc)', 'amount', 'amount_refunded', 'converted_amount_refunded', 'fee',
+                    'status', 'customer_id', 'date', 'reservation_id']
+
+
+def _mtime(path: str) -> Optional[int]:
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+class Refresher(threading.Thread):
+
+    def __init__(self, key: str, source: str, interval: float = REFRESH_SECONDS,
+                 offsets: Optional[Dict[str, int]] = None):
+        super().__init__(name='refresher-{key}'.format(key=key), daemon=True)
+        self.key = key
+        self.source = source
+        self.interval = interval
+        # the bytes the dataset was loaded from (`ingest.export_sizes`), rows written after them are appended
+        self._offsets: Dict[str, int] = dict(offsets if offsets is not None else export_sizes(source))
+        self._fleet_mtime = _mtime(FLEET_PATH)
+        self._stopped = threading.Event()
+        # the thread and catch-up requests poll the same offsets
+        self._poll_lock = threading.Lock()
+
+    def start(self) -> None:
+        data_store.set_poller(self.key, self.poll)
+        super().start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def respawn(self) -> 'Refresher':
+        """A new refresher continuing from this one's offsets, threads do not survive a fork."""
+        refresher = Refresher(self.key, self.source, self.interval, self._offsets)
+        refresher._fleet_mtime = self._fleet_mtime
+        return refresher
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as error:  # a broken export must not kill the refresher thread
+                print('refresh of {key} failed: {error!r}'.format(key=self.key, error=error))
+
+    def _read_appended(self, path: str) -> pd.DataFrame:
+        offset = self._offsets.get(path, 0)
+        with open(path, 'rb') as export:
+            header = export.readline()
+            export.seek(max(offset, len(header)))
+            appended = export.read()
+
+        # a row still being written is picked up by the next poll
+        complete = appended.rfind(b'\n') + 1
+        self._offsets[path] = max(offset, len(header)) + complete
+        if not complete:
+            return pd.DataFrame()
+        return pd.read_csv(io.BytesIO(header + appended[:complete]), dtype=CSV_DTYPES)
+
+    def poll(self) -> int:
+        """Append rows added since the last poll, returns how many were added."""
+        with self._poll_lock:
+            fleet_mtime = _mtime(FLEET_PATH)
+            if fleet_mtime != self._fleet_mtime:
+                self._fleet_mtime = fleet_mtime
+                data_store.set_fleet(self.key, FleetSize.load())
+
+            added = 0
+            for path in export_paths(self.source):
+                if os.path.getsize(path) <= self._offsets.get(path, 0):
+                    continue
+                rows = self._read_appended(path)
+                if len(rows):
+                    data_store.append(self.key, optimize(rows), version=sum(self._offsets.values()))
+                    added += len(rows)
+            return added
+
+
+def append_charges(key: str):
+    """View appending the JSON list of charge records of the current request to `key`."""
+    records = request.get_json(silent=True)
+    if not isinstance(records, list) or not records:
+        return jsonify(error='expected a non-empty JSON list of charge records'), 400
+
+    rows = pd.DataFrame.from_records(records)
+    missing = [column for column in REQUIRED_COLUMNS if column not in rows.columns]
+    if missing:
+        return jsonify(error='missing columns: {columns}'.format(columns=', '.join(missing))), 400
+
+    # ids are strings as read from the csv, a null stays missing instead of becoming 'None'
+    rows = rows[REQUIRED_COLUMNS].assign(**{column: rows[column].map(str, na_action='ignore')
+                                            for column in CSV_DTYPES})
+    try:
+        rows = optimize(rows)
+    except (TypeError, ValueError) as error:
+        return jsonify(error='invalid charge records: {error}'.format(error=error)), 400
+
+    dataset = data_store.append(key, rows)
+    return jsonify(dict(dataset, rows=len(rows)))
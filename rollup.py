@@ -0,0 +1,258 @@
+"""Materialized per-(date, status, customer) rollup of the charge table.
+
+The daily charts only group by date after filtering on status and customer, so they
+can be answered from this cube instead of scanning raw charges. A second cube keyed by
+(date, status, customer, hour) holds the hourly distributions. New charges are folded
+in with `update`, which only groups the new rows, so a rollup can also be fed chunk by
+chunk without ever holding the raw table.
+
+Money is summed in integer cents, like the charge table holds it, and only converted to
+dollars by `by_date`. Sums are also kept divided by the date's fleet size. Those
+per-scooter sums are additive like the plain ones, so per-scooter metrics need no join
+at query time.
+
+Both cubes are partitioned by month and sorted by date inside a partition. A date range
+query only touches the partitions it overlaps (and slices the edge ones on the sorted
+index), and an update only merges into the partitions its rows fall in. The newest
+month, where appended charges land, is partitioned per day, so an append rebuilds the
+cells of its days and not of the whole month. Those days are folded into one month
+partition once a later month has data.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from fleet import FleetSize
+from loader import CENTS
+
+KEYS = ['date', 'status', 'customer_id']
+SUM_COLUMNS = ['fee', 'amount', 'amount_refunded']
+SCOOTER_COLUMNS = [column + '_scooter' for column in SUM_COLUMNS]
+CUBE_COLUMNS = ['charges', 'reservations', 'distinct_reservations'] + SUM_COLUMNS + SCOOTER_COLUMNS
+# counts and cents, kept as integers through the merges
+INTEGER_COLUMNS = CUBE_COLUMNS[:3] + SUM_COLUMNS
+HOURLY_KEYS = KEYS + ['hour']
+HOURS = 24
+PARTITION_FREQ = 'M'
+# the newest month is partitioned per day, appends land there
+TAIL_FREQ = 'D'
+
+
+def _empty_cube(keys, columns) -> pd.DataFrame:
+    index = pd.MultiIndex.from_arrays([pd.DatetimeIndex([])] + [[]] * (len(keys) - 1), names=keys)
+    return pd.DataFrame({column: np.zeros(0) for column in columns}, index=index)
+
+
+def _select(cube: pd.DataFrame, status: Optional[str], customer_ids: Iterable[str]) -> pd.DataFrame:
+    # the selection is resolved on the index level codes, no values are compared row by row
+    customer_ids = list(customer_ids)
+    mask = np.ones(len(cube), dtype=bool)
+
+    if status:
+        level = KEYS.index('status')
+        code = cube.index.levels[level].get_indexer([status])[0]
+        mask &= (cube.index.codes[level] == code) & (code >= 0)
+    if customer_ids:
+        level = KEYS.index('customer_id')
+        selected = cube.index.levels[level].get_indexer(customer_ids)
+        mask &= np.isin(cube.index.codes[level], selected[selected >= 0])
+    return cube[mask]
+
+
+def _merge(cube: pd.DataFrame, delta: pd.DataFrame, counts) -> pd.DataFrame:
+    merged = cube.add(delta, fill_value=0) if len(cube) else delta
+    merged = merged.astype({column: 'int64' for column in counts}).sort_index()
+    # a delta grouped from a large batch keeps every customer and date of it in its levels,
+    # a partition keeps its own only, so merging into it stays proportional to its rows
+    return merged.set_axis(merged.index.remove_unused_levels())
+
+
+def _merge_partitions(partitions: Dict[pd.Period, pd.DataFrame], delta: pd.DataFrame, counts) -> Dict:
+    # a new dict is returned, readers holding the previous one never see it change under them
+    merged = dict(partitions)
+    dates = delta.index.get_level_values('date')
+    months = dates.to_period(PARTITION_FREQ)
+    newest = max([months.max()] + [period.asfreq(PARTITION_FREQ) for period in partitions])
+
+    # the days of a month are folded into one partition once a later month has data
+    days = sorted(period for period in partitions
+                  if period.freqstr == TAIL_FREQ and period.asfreq(PARTITION_FREQ) < newest)
+    for month in sorted({day.asfreq(PARTITION_FREQ) for day in days}):
+        merged[month] = pd.concat([merged.pop(day) for day in days if day.asfreq(PARTITION_FREQ) == month])
+
+    for month, part in delta.groupby(months):
+        pieces = part.groupby(part.index.get_level_values('date').to_period(TAIL_FREQ)) if month == newest else [
+            (month, part)]
+        for period, piece in pieces:
+            merged[period] = _merge(merged.get(period, piece.iloc[:0]), piece, counts)
+    return merged
+
+
+def _in_range(partitions: Dict[pd.Period, pd.DataFrame], keys, columns, start=None, end=None) -> pd.DataFrame:
+    """Rows of the partitions overlapping [start, end], whole history without bounds."""
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    pieces = []
+    for period in sorted(partitions, key=lambda period: period.start_time):
+        if (start is not None and period.end_time < start) or (end is not None and period.start_time > end):
+            continue
+        part = partitions[period]
+        if (start is not None and period.start_time < start) or (end is not None and period.end_time > end):
+            first, last = part.index.slice_locs(start=(start,) if start is not None else None,
+                                                end=(end,) if end is not None else None)
+            part = part.iloc[first:last]
+        pieces.append(part)
+
+    if not pieces:
+        return _empty_cube(keys, columns)
+    return pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+
+
+class Rollup:
+
+    def __init__(self, fleet: Optional[FleetSize] = None):
+        self.fleet = fleet if fleet is not None else FleetSize.load()
+        self._cubes: Dict[pd.Period, pd.DataFrame] = {}
+        self._hourly: Dict[pd.Period, pd.DataFrame] = {}
+        # hashes of seen reservation keys per date keep distinct counts exact across updates
+        self._seen_daily: Dict[pd.Timestamp, set] = {}
+        self._seen_hourly: Dict[pd.Timestamp, set] = {}
+        # customer ids in first-seen order, only ever extended: readers take the ones after those they know
+        self._customers: List[str] = []
+        self._known_customers = set()
+        # dates and statuses of the cube cells, replaced rather than mutated so readers never see them change
+        self._dates = frozenset()
+        self._statuses = frozenset()
+        self._lock = threading.Lock()
+
+    @property
+    def cube(self) -> pd.DataFrame:
+        return _in_range(self._cubes, KEYS, CUBE_COLUMNS)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fleet: Optional[FleetSize] = None) -> 'Rollup':
+        rollup = cls(fleet)
+        rollup.update(df)
+        return rollup
+
+    def _per_scooter(self, cells: pd.DataFrame) -> pd.DataFrame:
+        scooters = self.fleet.lookup(cells.index.get_level_values('date'))
+        for column in SUM_COLUMNS:
+            cells[column + '_scooter'] = cells[column].values / scooters
+        return cells
+
+    @staticmethod
+    def _first_seen(rows: pd.DataFrame, columns, seen: Dict[pd.Timestamp, set]) -> np.ndarray:
+        # values, not categoricals: those hash every category of the history on each batch
+        values = pd.DataFrame({column: np.asarray(rows[column]) for column in columns})
+        hashes = pd.Series(pd.util.hash_pandas_object(values, index=False).values)
+        candidates = np.flatnonzero((~hashes.duplicated()).values & rows['reservation_id'].notna().values)
+        dates = pd.Series(np.asarray(rows['date'])[candidates])
+
+        # only the batch is scanned, already seen keys are looked up in the set of their date
+        flags = np.zeros(len(rows), dtype=int)
+        for date, local in dates.groupby(dates).indices.items():
+            known = seen.setdefault(date, set())
+            keys = hashes.values[candidates[local]]
+            unseen = np.fromiter((key not in known for key in keys), dtype=bool, count=len(keys))
+            known.update(keys[unseen])
+            flags[candidates[local][unseen]] = 1
+        return flags
+
+    def update(self, rows: pd.DataFrame) -> None:
+        """Fold new charge rows into the cubes, only the new rows are grouped."""
+        if rows.empty:
+            return
+
+        with self._lock:
+            # key columns may be categoricals with batch-specific categories, the cubes keep plain values
+            keys = {column: np.asarray(rows[column]) for column in HOURLY_KEYS}
+            delta = rows[SUM_COLUMNS].astype(np.int64).assign(
+                charges=1,
+                reservations=rows['reservation_id'].notna().astype(int).values,
+                distinct_reservations=self._first_seen(rows, KEYS + ['reservation_id'], self._seen_daily),
+                **keys,
+            ).groupby(KEYS).sum()
+            delta = self._per_scooter(delta)[CUBE_COLUMNS]
+            hourly_delta = pd.DataFrame(dict(
+                keys, reservations=self._first_seen(rows, HOURLY_KEYS + ['reservation_id'], self._seen_hourly),
+            )).groupby(HOURLY_KEYS).sum()
+
+            new = [customer_id for customer_id in pd.unique(keys['customer_id'])
+                   if customer_id not in self._known_customers and not pd.isna(customer_id)]
+            self._known_customers.update(new)
+            self._customers.extend(new)
+            self._dates = self._dates.union(delta.index.get_level_values('date').unique())
+            self._statuses = self._statuses.union(delta.index.get_level_values('status').unique())
+            self._cubes = _merge_partitions(self._cubes, delta, INTEGER_COLUMNS)
+            self._hourly = _merge_partitions(self._hourly, hourly_delta, ['reservations'])
+
+    def set_fleet(self, fleet: FleetSize) -> None:
+        """Swap the fleet size table, the per-scooter sums are recomputed from the plain ones."""
+        with self._lock:
+            self.fleet = fleet
+            self._cubes = {month: self._per_scooter(cube.copy()) for month, cube in self._cubes.items()}
+
+    def forget_before(self, date) -> None:
+        """Drop the distinct-count bookkeeping of dates that will not receive charges anymore."""
+        with self._lock:
+            for seen in (self._seen_daily, self._seen_hourly):
+                for known in [known for known in seen if known < pd.Timestamp(date)]:
+                    del seen[known]
+
+    def dates(self) -> pd.Index:
+        return pd.DatetimeIndex(sorted(self._dates), name='date')
+
+    def statuses(self) -> pd.Index:
+        return pd.Index(sorted(self._statuses), dtype=object, name='status')
+
+    def customer_ids(self) -> pd.Index:
+        return pd.Index(self._customers, dtype=object).sort_values()
+
+    def customers_since(self, count: int) -> List[str]:
+        """Customer ids first seen after the first `count` ones."""
+        return self._customers[count:]
+
+    def cells(self, status: Optional[str], customer_ids: Iterable[str], start=None, end=None) -> pd.DataFrame:
+        """Cube cells matching a status, customer and date range selection."""
+        return _select(_in_range(self._cubes, KEYS, CUBE_COLUMNS, start, end), status, customer_ids)
+
+    @staticmethod
+    def by_date(cells: pd.DataFrame) -> pd.DataFrame:
+        """Per-date counts, sums and means of already selected cells.
+
+        Distinct reservations are counted per cell, like the hourly ones: without a status
+        filter, a reservation charged under several statuses counts once per status.
+        """
+        grouped = cells.groupby(level='date')
+        # dates missing from the fleet table keep NaN per-scooter values instead of zeros
+        daily = grouped.sum(min_count=1)
+        # a customer has one cell per status, so distinct customers are counted over (date, customer) pairs
+        customers = cells.index.droplevel('status').unique()
+        daily['customers'] = pd.Series(1, index=customers).groupby(level='date').size()
+        daily['revenue'] = daily['amount'] - daily['amount_refunded']
+        daily['revenue_scooter'] = daily['amount_scooter'] - daily['amount_refunded_scooter']
+
+        money = SUM_COLUMNS + ['revenue']
+        daily[money + [column + '_scooter' for column in money]] /= CENTS
+        for column in money:
+            daily[column + '_mean'] = daily[column] / daily['charges']
+            daily[column + '_mean_scooter'] = daily[column + '_scooter'] / daily['charges']
+        return daily
+
+    def hourly_counts(self, status: Optional[str] = None, customer_ids: Iterable[str] = (), start=None, end=None):
+        """Distinct reservations and customers per hour of the cells matching a selection.
+
+        Reservations are distinct within a status, without a status filter one charged
+        under several statuses in the same hour counts once per status.
+        """
+        cells = _select(_in_range(self._hourly, HOURLY_KEYS, ['reservations'], start, end), status, customer_ids)
+        hours = cells.index.get_level_values('hour').values.astype(np.intp)
+        reservations = np.bincount(hours, weights=cells['reservations'].values, minlength=HOURS)
+
+        # like the daily customers, statuses are collapsed before counting (date, customer, hour) keys
+        customers = cells.index.droplevel('status').unique().get_level_values('hour').values.astype(np.intp)
+        return reservations, np.bincount(customers, minlength=HOURS).astype(float)
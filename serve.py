@@ -0,0 +1,93 @@
+"""Production entry point serving a dashboard's Flask `server` with several worker processes.
+
+    python serve.py dash_app --workers 4 --bind 0.0.0.0:8887
+
+The app is created and its data loaded once, in the gunicorn master, so the typed charge table (its
+numeric columns memory-mapped from the Arrow cache), the rollup and the indexes are built
+once and the forked workers share their pages copy-on-write. Those objects are frozen
+out of the garbage collector's reach before forking, otherwise every collection in a
+worker would write to their headers and copy the pages into the worker. Worker memory
+then grows with the per-request allocations, not with the dataset.
+
+Threads do not survive a fork, so the master's refresher is stopped and every worker
+continues from its offsets with a refresher of its own, each worker appends the same
+new charges. Appended rows are kept as segments after the shared loaded frame, and the
+rollup and cohorts only touch the partitions and keys of the new rows, so a worker's
+private pages grow with what it appended, not with a copy of the table. Dataset
+versions are the export bytes read, so workers holding the same charges agree on them,
+and a worker behind a client's version polls the export before answering. Aggregation
+jobs live in the worker that accepted them, a poll reaching another worker submits the
+aggregation there. Charges pushed through `POST /api/charges` only reach the worker
+that received them, with several workers append them to the export instead.
+"""
+import argparse
+import gc
+import importlib
+import multiprocessing
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn is only needed here, the apps still run on their own with `run_server`
+    BaseApplication = None
+
+BIND = '0.0.0.0:8887'
+WORKERS = multiprocessing.cpu_count()
+# request threads per worker, the job polling callbacks are short
+THREADS = 4
+# aggregation job processes per worker
+JOB_WORKERS = 1
+TIMEOUT_SECONDS = 60
+
+
+def preload(app: str, job_workers: int = JOB_WORKERS):
+    """Create the app once in the master and get its shared state ready for forking."""
+    dash_app = importlib.import_module(app).create_app({'preload': True, 'job_workers': job_workers})
+    dash_app.refresher.stop()
+
+    gc.collect()
+    gc.freeze()
+    return dash_app
+
+
+def post_fork(server, worker) -> None:
+    dash_app = server.app.dash_app
+    dash_app.refresher = dash_app.refresher.respawn()
+    dash_app.refresher.start()
+
+
+if BaseApplication is not None:
+    class DashboardServer(BaseApplication):
+
+        def __init__(self, dash_app, options: dict):
+            self.dash_app = dash_app
+            self.options = options
+            super().__init__()
+
+        def load_config(self) -> None:
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.dash_app.server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('app', choices=['dash_app', 'dash_app_refactored'])
+    parser.add_argument('--bind', default=BIND)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--threads', type=int, default=THREADS)
+    parser.add_argument('--job-workers', type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+
+    if BaseApplication is None:
+        raise SystemExit('serving with several workers needs gunicorn: pip install gunicorn')
+
+    DashboardServer(preload(args.app, args.job_workers), {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'timeout': TIMEOUT_SECONDS,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
@@ -0,0 +1,109 @@
+"""Daily metrics snapshots served over HTTP.
+
+`GET /api/daily` returns the per-date reservations (charges with one, and distinct ones),
+customers, fees, refunds, revenue and margin (revenue - fee) the dashboard plots, for a
+status, customers and a date range:
+
+    /api/daily?start=2020-04-01&end=2020-04-30&status=Paid&customer_id=cus_1&customer_id=cus_2&format=csv
+
+`format` is json (the default, pandas' compact split orientation), csv or arrow (an
+Arrow IPC stream, needs pyarrow). Without `status` every status is counted, without
+dates the whole history is returned.
+
+The numbers come from the shared aggregates cache, and rendered bodies are kept per
+(dataset version, filters, format). The ETag is derived from that key alone, so a
+client sending back `If-None-Match` gets a 304 without anything being computed until
+charges are appended.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from flask import Response, jsonify, request
+
+import data_store
+from aggregations import get_aggregates, results_key
+
+try:
+    import pyarrow as pa
+except ImportError:  # arrow snapshots are optional, json and csv work without pyarrow
+    pa = None
+
+COLUMNS = ['reservations', 'distinct_reservations', 'customers', 'fee', 'amount', 'amount_refunded', 'revenue',
+           'margin']
+MONEY_COLUMNS = ['fee', 'amount', 'amount_refunded', 'revenue', 'margin']
+FORMATS = {'json': 'application/json', 'csv': 'text/csv', 'arrow': 'application/vnd.apache.arrow.stream'}
+BODIES_TO_KEEP = 32
+
+_bodies = OrderedDict()
+_lock = threading.Lock()
+
+
+def daily_metrics(dataset: dict, status, customer_ids, start=None, end=None) -> pd.DataFrame:
+    aggregates = get_aggregates(dataset, status, customer_ids, start, end)
+    # a join of two empty frames falls back to an object index, concat keeps the dates
+    daily = pd.concat([aggregates.counts, aggregates.gross], axis=1)
+    daily['margin'] = daily['revenue'] - daily['fee']
+    # dollar amounts are not exact binary fractions, their differences carry noise, the export is in cents
+    daily[MONEY_COLUMNS] = daily[MONEY_COLUMNS].round(2)
+    return daily[COLUMNS].rename_axis('date')
+
+
+def render(daily: pd.DataFrame, output: str) -> bytes:
+    if output == 'csv':
+        return daily.to_csv(date_format='%Y-%m-%d').encode()
+    if output == 'arrow':
+        table = pa.Table.from_pandas(daily.reset_index(), preserve_index=False)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+    daily = daily.set_axis(daily.index.strftime('%Y-%m-%d'))
+    return daily.to_json(orient='split').encode()
+
+
+def etag(key: tuple, output: str) -> str:
+    return hashlib.sha1(repr((key, output)).encode()).hexdigest()
+
+
+def serve_snapshot(key: str):
+    """View of the daily metrics of dataset `key` for the current request."""
+    output = request.args.get('format', 'json')
+    if output not in FORMATS:
+        return jsonify(error='format must be one of: {formats}'.format(formats=', '.join(FORMATS))), 400
+    if output == 'arrow' and pa is None:
+        return jsonify(error='arrow snapshots need pyarrow'), 406
+
+    customer_ids = [customer_id for value in request.args.getlist('customer_id')
+                    for customer_id in value.split(',') if customer_id]
+    try:
+        dataset = data_store.handle(key)
+        cache_key = results_key(dataset, request.args.get('status'), customer_ids,
+                                request.args.get('start'), request.args.get('end'))
+    except ValueError as error:
+        return jsonify(error='invalid date: {error}'.format(error=error)), 400
+
+    tag = etag(cache_key, output)
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+        response.set_etag(tag)
+        return response
+
+    with _lock:
+        body = _bodies.get((cache_key, output))
+        if body is not None:
+            _bodies.move_to_end((cache_key, output))
+    if body is None:
+        body = render(daily_metrics(dataset, *cache_key[2:]), output)
+        with _lock:
+            _bodies[cache_key, output] = body
+            while len(_bodies) > BODIES_TO_KEEP:
+                _bodies.popitem(last=False)
+
+    response = Response(body, mimetype=FORMATS[output])
+    response.set_etag(tag)
+    # clients may keep the body but have to revalidate it, appended charges change the tag
+    response.cache_control.no_cache = True
+    return response
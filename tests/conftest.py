@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# the modules live at the repository root, next to the apps
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_charges  # noqa: E402
+from loader import CENTS, CSV_DTYPES, MONEY_COLUMNS, optimize  # noqa: E402
+
+
+def raw_charges(rows: int, **kwargs) -> pd.DataFrame:
+    """Synthetic charges as the export has them, money in dollars."""
+    charges = synthetic_charges(rows, **kwargs)
+    return charges.drop(columns='hour').assign(**{column: charges[column] / CENTS for column in MONEY_COLUMNS})
+
+
+def write_export(rows: pd.DataFrame, path) -> str:
+    rows.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    return str(path)
+
+
+def read_export(path) -> pd.DataFrame:
+    """The typed frame of an export, parsed at once."""
+    return optimize(pd.read_csv(path, dtype=CSV_DTYPES))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # caches and the fleet size table are looked up relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+import aggregations
+import data_store
+import ingest
+from conftest import raw_charges, read_export, write_export
+from refresher import Refresher, append_charges
+
+SELECTIONS = [(None, [], None, None), ('Paid', [], None, None), ('Refunded', [], '2020-01-05', '2020-01-12'),
+              (None, ['cus_0000000003', 'cus_0000000007', 'cus_missing'], None, None),
+              ('Paid', ['cus_0000000003'], '2020-01-03', None)]
+
+
+def assert_same_aggregates(dataset: dict, expected: dict) -> None:
+    for status, customer_ids, start, end in SELECTIONS:
+        actual_aggregates = aggregations.aggregate(*data_store.snapshot(dataset), status, customer_ids, start, end)
+        expected_aggregates = aggregations.aggregate(*data_store.snapshot(expected), status, customer_ids, start, end)
+        for actual, wanted in zip(actual_aggregates, expected_aggregates):
+            if isinstance(wanted, pd.DataFrame):
+                pd.testing.assert_frame_equal(actual, wanted)
+            else:
+                np.testing.assert_allclose(actual, wanted)
+
+
+@pytest.mark.parametrize('batch_rows', [1, 17, 250])
+def test_segmented_appends_match_a_rebuild(workdir, batch_rows):
+    rows = read_export(write_export(raw_charges(900, customers=30, days=15), workdir / 'charges.csv'))
+    dataset = data_store.register('appended', rows[:300])
+    for start in range(300, len(rows), batch_rows):
+        dataset = data_store.append('appended', rows[start:start + batch_rows])
+    rebuilt = data_store.register('rebuilt', rows)
+
+    charges = data_store.snapshot(dataset)[0]
+    assert len(charges.segments) <= 2 + int(np.log2(len(rows)))
+    pd.testing.assert_frame_equal(charges.take(None, list(rows.columns)).astype(rows.dtypes), rows,
+                                  check_categorical=False)
+    pd.testing.assert_frame_equal(data_store.get_rollup(dataset).cube, data_store.get_rollup(rebuilt).cube)
+    assert_same_aggregates(dataset, rebuilt)
+
+
+@pytest.mark.parametrize('chunk_rows', [None, 100])
+def test_refresher_reads_the_rows_written_during_the_load(workdir, chunk_rows):
+    lines = write_export(raw_charges(500, customers=20, days=10), workdir / 'all.csv')
+    lines = open(lines).read().splitlines(keepends=True)
+    path = workdir / 'charges.csv'
+    # the last row is still being written when the load starts
+    path.write_text(''.join(lines[:301]) + lines[301][:20])
+    sizes = ingest.export_sizes(str(path))
+    with open(path, 'a') as export:
+        export.write(lines[301][20:] + ''.join(lines[302:]))
+
+    # versions never move back, every case registers a key of its own
+    key = 'live-{chunk_rows}'.format(chunk_rows=chunk_rows)
+    dataset = ingest.load_dataset(key, str(path), chunk_rows, sizes)
+    assert data_store.get_rollup(dataset).cube['charges'].sum() == 300
+
+    assert Refresher(key, str(path), offsets=sizes).poll() == 200
+    rebuilt = data_store.register('complete', read_export(path))
+    pd.testing.assert_frame_equal(data_store.get_rollup(key).cube, data_store.get_rollup(rebuilt).cube)
+    assert data_store.version(key) == path.stat().st_size
+
+
+@pytest.fixture
+def client(workdir):
+    data_store.register('posted', read_export(write_export(raw_charges(50, customers=5, days=3),
+                                                           workdir / 'charges.csv')))
+    app = Flask(__name__)
+    app.add_url_rule('/api/charges', 'append_charges', lambda: append_charges('posted'), methods=['POST'])
+    return app.test_client()
+
+
+def charge(**values) -> dict:
+    record = {'id': 'ch_new', 'created_(utc)': '2020-01-03 10:00:00', 'amount': 12.5, 'amount_refunded': 0.0,
+              'converted_amount_refunded': 0.0, 'fee': 0.5, 'status': 'Paid', 'customer_id': 'cus_new',
+              'date': '2020-01-03', 'reservation_id': 'res_new'}
+    record.update(values)
+    return record
+
+
+def test_posted_charges_are_appended(client):
+    version = data_store.version('posted')
+
+    response = client.post('/api/charges', json=[charge(), charge(id='ch_other', amount='7.25')])
+
+    assert response.status_code == 200
+    assert response.get_json() == {'key': 'posted', 'version': version + 1, 'rows': 2}
+    rows = data_store.snapshot('posted')[0].segments[-1]
+    assert rows['amount'].tolist() == [1250, 725]
+    assert 'cus_new' in data_store.get_rollup('posted').customer_ids()
+
+
+def test_null_ids_stay_missing(client):
+    response = client.post('/api/charges', json=[charge(customer_id=None, reservation_id=None),
+                                                 charge(id='ch_other', status=None)])
+
+    assert response.status_code == 200
+    rows = data_store.snapshot('posted')[0].segments[-1]
+    assert rows[['customer_id', 'reservation_id']].iloc[0].isna().all()
+    assert pd.isna(rows['status'].iloc[1])
+    rollup = data_store.get_rollup('posted')
+    assert 'None' not in rollup.customer_ids()
+    assert 'None' not in rollup.statuses()
+
+
+@pytest.mark.parametrize('records', [
+    [charge(amount='abc')],
+    [charge(amount=None)],
+    [charge(fee=1e9)],
+    [charge(date='not a date')],
+    [charge(), charge(id='ch_other', **{'created_(utc)': 'yesterday'})],
+])
+def test_uncastable_charges_are_rejected(client, records):
+    version = data_store.version('posted')
+
+    response = client.post('/api/charges', json=records)
+
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('invalid charge records')
+    assert data_store.version('posted') == version
+
+
+@pytest.mark.parametrize('body', [None, [], {'id': 'ch_new'}, [{'id': 'ch_new'}]])
+def test_malformed_bodies_are_rejected(client, body):
+    response = client.post('/api/charges', json=body)
+
+    assert response.status_code == 400
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cohorts import Cohorts
+from conftest import raw_charges
+
+
+def paid(*charges) -> pd.DataFrame:
+    """Paid charges of (customer, date, reservation) triples."""
+    customers, dates, reservations = zip(*charges)
+    return pd.DataFrame({'status': 'Paid', 'customer_id': list(customers), 'date': pd.to_datetime(dates),
+                         'reservation_id': list(reservations)})
+
+
+def test_late_rows_move_a_customer_to_an_earlier_cohort():
+    cohorts = Cohorts(max_days=7)
+    cohorts.update(paid(('a', '2020-01-05', 'r1'), ('a', '2020-01-06', 'r2'), ('b', '2020-01-05', 'r3')))
+    assert cohorts.repeat_rentals(freq='D')['customers'].to_dict() == {pd.Timestamp('2020-01-05'): 2}
+
+    cohorts.update(paid(('a', '2020-01-02', 'r4')))
+
+    repeat = cohorts.repeat_rentals(freq='D')
+    assert repeat['customers'].to_dict() == {pd.Timestamp('2020-01-02'): 1, pd.Timestamp('2020-01-05'): 1}
+    assert repeat['rentals'].to_dict() == {pd.Timestamp('2020-01-02'): 3, pd.Timestamp('2020-01-05'): 1}
+    retention = cohorts.retention(freq='D')
+    # a is active on days 0, 3 and 4 of its new cohort, b only on its first day
+    np.testing.assert_array_equal(retention.loc['2020-01-02'].values[:5], [1, 0, 0, 1, 1])
+    np.testing.assert_array_equal(retention.loc['2020-01-05'].values[:2], [1, 0])
+    assert retention.loc['2020-01-05'].iloc[2:].isna().all()
+
+
+def test_rows_after_the_first_date_keep_the_cohort():
+    cohorts = Cohorts(max_days=7)
+    cohorts.update(paid(('a', '2020-01-02', 'r1')))
+    cohorts.update(paid(('a', '2020-01-04', 'r2'), ('a', '2020-01-04', 'r2'), ('a', '2020-01-02', 'r1')))
+
+    repeat = cohorts.repeat_rentals(freq='D')
+    assert repeat['customers'].to_dict() == {pd.Timestamp('2020-01-02'): 1}
+    assert repeat['rentals'].to_dict() == {pd.Timestamp('2020-01-02'): 2}
+    np.testing.assert_array_equal(cohorts.retention(freq='D').loc['2020-01-02'].values[:3], [1, 0, 1])
+
+
+@pytest.mark.parametrize('batch_rows', [1, 37, 400])
+def test_shuffled_batches_match_the_whole_frame(batch_rows):
+    rows = raw_charges(800, customers=60, days=40)
+    shuffled = rows.sample(frac=1, random_state=0).reset_index(drop=True)
+
+    cohorts = Cohorts()
+    for start in range(0, len(shuffled), batch_rows):
+        cohorts.update(shuffled[start:start + batch_rows])
+    expected = Cohorts.from_frame(rows)
+
+    for customer_ids in [[], ['cus_0000000004', 'cus_0000000011', 'cus_missing']]:
+        for freq in ['D', 'W']:
+            pd.testing.assert_frame_equal(cohorts.retention(customer_ids, freq=freq),
+                                          expected.retention(customer_ids, freq=freq))
+            pd.testing.assert_frame_equal(cohorts.repeat_rentals(customer_ids, freq=freq),
+                                          expected.repeat_rentals(customer_ids, freq=freq))
@@ -0,0 +1,71 @@
+import importlib
+
+import pytest
+
+from conftest import raw_charges, write_export
+
+APPS = ['dash_app', 'dash_app_refactored']
+
+
+def find(component, component_id: str):
+    """The layout component with `component_id`, searched through the children."""
+    if isinstance(component, dict):
+        if component.get('props', {}).get('id') == component_id:
+            return component
+        component = component.get('props', {}).get('children')
+    for child in component if isinstance(component, list) else [component] if isinstance(component, dict) else []:
+        found = find(child, component_id)
+        if found is not None:
+            return found
+    return None
+
+
+@pytest.fixture(params=[(app, chunk_rows) for app in APPS for chunk_rows in [None, 50]],
+                ids=lambda param: '{}-{}'.format(*param))
+def app(request, workdir):
+    # an export holding only its header, as written before the first charge of the day
+    path = write_export(raw_charges(1)[:0], workdir / 'charges.csv')
+    name, chunk_rows = request.param
+    key = 'empty-{name}-{chunk_rows}'.format(name=name, chunk_rows=chunk_rows)
+    return importlib.import_module(name).create_app({'data_path': path, 'dataset_key': key, 'refresh': False,
+                                                     'preload': True, 'ingest_chunk_rows': chunk_rows})
+
+
+def test_layout_has_no_date_bounds(app):
+    response = app.server.test_client().get('/_dash-layout')
+
+    assert response.status_code == 200
+    date_range = find(response.get_json(), 'date-range-selector')
+    assert date_range is not None
+    assert not {'min_date_allowed', 'max_date_allowed', 'start_date', 'end_date'} & set(date_range['props'])
+    assert find(response.get_json(), 'status-selector')['props']['options'] == []
+
+
+@pytest.mark.parametrize('output', ['json', 'csv', 'arrow'])
+def test_daily_snapshot_is_empty(app, output):
+    response = app.server.test_client().get('/api/daily?format={output}'.format(output=output))
+
+    assert response.status_code == 200
+    if output == 'json':
+        assert response.get_json()['data'] == []
+    if output == 'csv':
+        assert len(response.data.decode().splitlines()) == 1
+
+
+def test_refresh_leaves_the_date_bound_alone(app):
+    layout = app.server.test_client().get('/_dash-layout').get_json()
+    dataset = find(layout, 'data-store')['props']['data']
+    # a client holding an older version gets the current handle and options
+    body = {'output': '..data-store.data...status-selector.options...date-range-selector.max_date_allowed..',
+            'outputs': [{'id': 'data-store', 'property': 'data'}, {'id': 'status-selector', 'property': 'options'},
+                        {'id': 'date-range-selector', 'property': 'max_date_allowed'}],
+            'inputs': [{'id': 'refresh-interval', 'property': 'n_intervals', 'value': 1}],
+            'state': [{'id': 'data-store', 'property': 'data', 'value': dict(dataset, version=0)}],
+            'changedPropIds': ['refresh-interval.n_intervals']}
+
+    response = app.server.test_client().post('/_dash-update-component', json=body)
+
+    assert response.status_code == 200
+    outputs = response.get_json()['response']
+    assert outputs['status-selector'] == {'options': []}
+    assert 'date-range-selector' not in outputs
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_store
+import ingest
+from conftest import raw_charges, read_export, write_export
+from fleet import FleetSize
+from rollup import Rollup
+
+CHUNK_ROWS = [7, 13, 50, 1000]
+
+
+def assert_same_rollup(streamed: Rollup, loaded: Rollup) -> None:
+    pd.testing.assert_frame_equal(streamed.cube, loaded.cube)
+    pd.testing.assert_index_equal(streamed.dates(), loaded.dates())
+    pd.testing.assert_index_equal(streamed.statuses(), loaded.statuses())
+    pd.testing.assert_index_equal(streamed.customer_ids(), loaded.customer_ids())
+    for status, customer_ids in [(None, []), ('Paid', []), ('Refunded', ['cus_0000000001', 'cus_0000000002'])]:
+        for expected, actual in zip(loaded.hourly_counts(status, customer_ids),
+                                    streamed.hourly_counts(status, customer_ids)):
+            np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_ROWS)
+def test_streamed_rollup_matches_the_loaded_one(workdir, chunk_rows):
+    path = write_export(raw_charges(600, customers=40, days=20), workdir / 'charges.csv')
+
+    streamed = ingest.ingest(path, chunk_rows, rollup=Rollup(FleetSize()))
+
+    assert_same_rollup(streamed, Rollup.from_frame(read_export(path), FleetSize()))
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_ROWS)
+def test_out_of_order_export_is_folded_again(workdir, chunk_rows):
+    rows = raw_charges(600, customers=40, days=20)
+    # late charges of the first days arrive after dates were already forgotten
+    rows = pd.concat([rows[100:], rows[:100]], ignore_index=True)
+    path = write_export(rows, workdir / 'charges.csv')
+
+    streamed = ingest.ingest(path, chunk_rows, rollup=Rollup(FleetSize()))
+
+    assert_same_rollup(streamed, Rollup.from_frame(read_export(path), FleetSize()))
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_ROWS)
+def test_directory_export_streams_every_file(workdir, chunk_rows):
+    rows = raw_charges(600, customers=40, days=20)
+    (workdir / 'export').mkdir()
+    for number, bounds in enumerate([(0, 250), (250, 250), (250, 600)]):
+        write_export(rows[slice(*bounds)], workdir / 'export' / 'day_{number}.csv'.format(number=number))
+    whole = write_export(rows, workdir / 'charges.csv')
+
+    streamed = ingest.ingest(str(workdir / 'export'), chunk_rows, rollup=Rollup(FleetSize()))
+
+    assert_same_rollup(streamed, Rollup.from_frame(read_export(whole), FleetSize()))
+
+
+def test_directory_export_loads_every_file(workdir):
+    rows = raw_charges(300, customers=20, days=10)
+    (workdir / 'export').mkdir()
+    write_export(rows[:120], workdir / 'export' / 'a.csv')
+    write_export(rows[:0], workdir / 'export' / 'b.csv')
+    write_export(rows[120:], workdir / 'export' / 'c.csv')
+
+    dataset = ingest.load_dataset('directory', str(workdir / 'export'))
+    charges, _, rollup = data_store.snapshot(dataset)
+
+    assert len(charges) == len(rows)
+    assert dataset['version'] == sum(ingest.export_sizes(str(workdir / 'export')).values())
+    expected = Rollup.from_frame(read_export(write_export(rows, workdir / 'charges.csv')))
+    pd.testing.assert_frame_equal(rollup.cube, expected.cube)
+
+
+def test_directory_without_exports_is_rejected(workdir):
+    (workdir / 'export').mkdir()
+
+    with pytest.raises(ValueError, match='no csv exports'):
+        ingest.load_dataset('nothing', str(workdir / 'export'))